@@ -0,0 +1,261 @@
+import argparse
+import hashlib
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+import util
+import config
+from entity import molecule
+from entity.molecule import RENDER_QUALITY
+from util import challenge
+from util.mdl_mol_parser import MdlMolParser
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+"""
+分子库基准测试
+对 resource/mol 中的分子依次计时解析、init_once、手性碳检测、渲染（布局、网格、化学键、原子、缩放）与 PNG 编码，
+统计各阶段的吞吐量与 p50/p95/p99 耗时、tracemalloc 峰值内存以及最慢的分子，结果可保存为基准并与之比较:
+
+python -m benchmark.corpus --output baseline.json
+python -m benchmark.corpus --compare baseline.json --threshold 0.1
+python -m benchmark.corpus --no-render --chiral-mode recursive --output recursive.json
+python -m benchmark.corpus --no-render --chiral-mode symmetry --compare recursive.json  # 在全库上比较两种手性碳检测引擎
+"""
+
+VERSION = 1
+
+RENDER_STAGES = ("layout", "grid", "bonds", "atoms", "resize")
+STAGES = ("parse", "init_once", "chirality") + tuple(f"render.{s}" for s in RENDER_STAGES) + \
+         ("render", "png_encode", "total")
+# 不渲染时只统计这些阶段
+NO_RENDER_STAGES = ("parse", "init_once", "chirality", "total")
+
+# 比较时忽略绝对差值小于该值（毫秒）的变化，避免极短的阶段因计时抖动被误判为退化
+MIN_DELTA_MS = 0.05
+
+
+def run_one(path: str, params: dict, render: bool = True):
+    """
+    处理单个分子，文件读取不计入耗时
+
+    :param render: 是否渲染与编码 PNG，为 False 时只统计 NO_RENDER_STAGES
+
+    :return: (cid, {阶段: 耗时（秒）})
+    """
+
+    with open(path, "rb") as f:
+        data = f.read()
+
+    clock = time.perf_counter
+    t0 = clock()
+    mol = MdlMolParser.parse_bytes(data, init=False)
+    t1 = clock()
+    mol.init_once()
+    t2 = clock()
+    mol.get_chiral_carbons()
+    t3 = clock()
+    if not render:
+        return mol.cid, {"parse": t1 - t0, "init_once": t2 - t1, "chirality": t3 - t2, "total": t3 - t0}
+    render_timings = {}
+    image, _, _ = mol.render_molecule(**params, timings=render_timings)
+    t4 = clock()
+    challenge.encode_png(image)
+    t5 = clock()
+
+    seconds = {"parse": t1 - t0, "init_once": t2 - t1, "chirality": t3 - t2, "render": t4 - t3,
+               "png_encode": t5 - t4, "total": t5 - t0}
+    for stage in RENDER_STAGES:
+        seconds[f"render.{stage}"] = render_timings.get(stage, 0.0)
+    return mol.cid, seconds
+
+
+def measure_memory(paths, params, render: bool = True):
+    """
+    逐个分子在 tracemalloc 下重新处理一遍，统计 Python 堆的峰值（不含 Pillow 在 C 层分配的图像缓冲区）
+
+    :return: [(峰值字节数, cid, 文件名)]
+    """
+
+    peaks = []
+    for path in paths:
+        tracemalloc.start()
+        try:
+            cid, _ = run_one(path, params, render)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        peaks.append((peak, cid, os.path.basename(path)))
+    return peaks
+
+
+def percentile(values, p: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def summarize(seconds) -> dict:
+    seconds = sorted(seconds)
+    total = sum(seconds)
+    return {"n": len(seconds),
+            "total_s": total,
+            "per_sec": len(seconds) / total if total > 0 else 0.0,
+            "mean_ms": statistics.mean(seconds) * 1000 if seconds else 0.0,
+            "p50_ms": percentile(seconds, 0.5) * 1000,
+            "p95_ms": percentile(seconds, 0.95) * 1000,
+            "p99_ms": percentile(seconds, 0.99) * 1000}
+
+
+def bench(paths, params: dict, memory: bool = True, top: int = 10, progress_every: int = 500, stream=sys.stderr,
+          render: bool = True):
+    """
+    :param memory: 是否额外执行一遍 tracemalloc 统计峰值内存
+    :param render: 是否渲染，为 False 时只统计解析与手性碳检测，便于在全库上比较手性碳检测引擎
+    :param top: 记录最慢的分子数
+    :return: 基准结果，可直接保存为 JSON
+    """
+
+    # 预热字体与字形缓存，不计入结果
+    if paths:
+        run_one(paths[0], params, render)
+
+    stages = STAGES if render else NO_RENDER_STAGES
+    samples = {stage: [] for stage in stages}
+    per_molecule = []
+    start = time.time()
+    for n, path in enumerate(paths, start=1):
+        cid, seconds = run_one(path, params, render)
+        for stage in stages:
+            samples[stage].append(seconds[stage])
+        per_molecule.append((seconds["total"], cid, os.path.basename(path), seconds))
+        if progress_every and n % progress_every == 0:
+            print(f"{n}/{len(paths)} molecules, {time.time() - start:.1f}s", file=stream)
+
+    per_molecule.sort(key=lambda m: m[0], reverse=True)
+    result = {
+        "version": VERSION,
+        "meta": {"python": platform.python_version(),
+                 "platform": platform.platform(),
+                 "molecules": len(paths),
+                 "corpus": hashlib.sha1("\n".join(os.path.basename(p) for p in paths).encode("utf-8")).hexdigest(),
+                 "chiral_mode": config.chiral_mode,
+                 "render": render,
+                 "params": json.loads(json.dumps(params))},  # 与读回的基准一致，元组保存为列表
+        "stages": {stage: summarize(samples[stage]) for stage in stages},
+        "slowest": [{"cid": cid, "file": name, "total_ms": total * 1000,
+                     "stages": {s: seconds[s] * 1000 for s in stages if s != "total"}}
+                    for total, cid, name, seconds in per_molecule[:top]],
+    }
+
+    if memory and paths:
+        peaks = measure_memory(paths, params, render)
+        peak, cid, name = max(peaks)
+        result["memory"] = {"peak_mb": peak / 2 ** 20, "peak_cid": cid, "peak_file": name,
+                            "mean_peak_mb": statistics.mean(p[0] for p in peaks) / 2 ** 20}
+    if resource is not None:
+        # Linux 上单位为 KB，macOS 上为字节
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result.setdefault("memory", {})["max_rss_mb"] = rss / (2 ** 20 if sys.platform == "darwin" else 2 ** 10)
+    return result
+
+
+def report(result: dict):
+    meta = result["meta"]
+    print(f"{meta['molecules']} molecules, quality={meta['params']['quality']}, "
+          f"chiral_mode={meta.get('chiral_mode')}, "
+          f"python {meta['python']} on {meta['platform']}")
+    print(f"{'stage':<16}{'n':>6}{'total s':>10}{'mol/s':>10}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage, s in result["stages"].items():
+        print(f"{stage:<16}{s['n']:>6}{s['total_s']:>10.2f}{s['per_sec']:>10.1f}{s['mean_ms']:>10.2f}"
+              f"{s['p50_ms']:>10.2f}{s['p95_ms']:>10.2f}{s['p99_ms']:>10.2f}")
+
+    memory = result.get("memory", {})
+    if "peak_mb" in memory:
+        print(f"tracemalloc peak {memory['peak_mb']:.1f} MB (cid={memory['peak_cid']}, {memory['peak_file']}), "
+              f"mean {memory['mean_peak_mb']:.1f} MB per molecule")
+    if "max_rss_mb" in memory:
+        print(f"max RSS {memory['max_rss_mb']:.1f} MB")
+
+    if result["slowest"]:
+        print("slowest molecules:")
+        print(f"{'cid':>10}  {'file':<12}{'total ms':>10}{'parse':>9}{'chiral':>9}{'render':>9}{'png':>9}")
+        for m in result["slowest"]:
+            s = m["stages"]
+            print(f"{m['cid']:>10}  {m['file']:<12}{m['total_ms']:>10.1f}{s['parse'] + s['init_once']:>9.1f}"
+                  f"{s['chirality']:>9.1f}{s.get('render', 0.0):>9.1f}{s.get('png_encode', 0.0):>9.1f}")
+
+
+def compare(result: dict, baseline: dict, threshold: float = 0.1, metric: str = "p50_ms"):
+    """
+    与基准比较，耗时或峰值内存增加超过 threshold（比例）时视为退化
+
+    :return: 退化项列表 [(名称, 基准值, 当前值)]
+    """
+
+    if baseline.get("version") != VERSION:
+        raise ValueError(f"Unsupported baseline version: {baseline.get('version')}")
+    for key in ("molecules", "corpus", "chiral_mode", "render", "params"):
+        if baseline["meta"].get(key) != result["meta"].get(key):
+            print(f"warning: baseline was recorded with a different {key}, results may not be comparable")
+
+    rows = [(f"{stage} {metric}", baseline["stages"][stage][metric], s[metric], MIN_DELTA_MS)
+            for stage, s in result["stages"].items() if stage in baseline["stages"]]
+    old_memory, new_memory = baseline.get("memory", {}), result.get("memory", {})
+    if "peak_mb" in old_memory and "peak_mb" in new_memory:
+        rows.append(("tracemalloc peak_mb", old_memory["peak_mb"], new_memory["peak_mb"], 0.0))
+
+    regressions = []
+    print(f"{'metric':<28}{'baseline':>12}{'current':>12}{'change':>10}")
+    for name, old, new, min_delta in rows:
+        change = (new - old) / old if old > 0 else 0.0
+        regressed = change > threshold and new - old > min_delta
+        if regressed:
+            regressions.append((name, old, new))
+        print(f"{name:<28}{old:>12.2f}{new:>12.2f}{change:>+10.1%}{'  REGRESSION' if regressed else ''}")
+    print(f"{len(regressions)} regression(s) beyond {threshold:.0%}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark every pipeline stage over the molecule corpus")
+    parser.add_argument("--mol-dir", default="resource/mol", help="directory of .mol files")
+    parser.add_argument("--limit", type=int, default=0, help="number of molecules (0 for the whole corpus)")
+    parser.add_argument("--quality", default=challenge.render_params()["quality"], choices=list(RENDER_QUALITY))
+    parser.add_argument("--chiral-mode", default=config.chiral_mode, choices=("recursive", "symmetry"),
+                        help="chiral carbon detection engine")
+    parser.add_argument("--top", type=int, default=10, help="number of slowest molecules to report")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--no-render", action="store_true",
+                        help="only time parsing and chiral carbon detection (fast enough for the whole corpus)")
+    parser.add_argument("--output", default=None, help="write results to this JSON baseline file")
+    parser.add_argument("--compare", default=None, help="compare against this JSON baseline file")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown reported as a regression")
+    parser.add_argument("--metric", default="p50_ms", choices=("mean_ms", "p50_ms", "p95_ms", "p99_ms"),
+                        help="per-stage statistic used for comparison")
+    args = parser.parse_args()
+
+    molecule.logger.level = util.logger.LEVEL_ERROR
+    config.chiral_mode = args.chiral_mode
+    files = sorted(f for f in os.listdir(args.mol_dir) if f.endswith(".mol"))
+    if args.limit > 0:
+        files = files[::max(1, len(files) // args.limit)][:args.limit]
+    paths = [os.path.join(args.mol_dir, f) for f in files]
+
+    params = dict(challenge.render_params(), quality=args.quality)
+    result = bench(paths, params, not args.no_memory, args.top, render=not args.no_render)
+    report(result)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(result, baseline, args.threshold, args.metric):
+            sys.exit(1)
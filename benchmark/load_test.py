@@ -0,0 +1,165 @@
+import argparse
+import asyncio
+import base64
+import io
+import json
+import statistics
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+
+from PIL import Image
+
+from util import challenge
+
+"""
+题目服务压力测试
+多个并发客户端通过 keep-alive 连接循环执行 GET /challenge 与 POST /verify，统计各接口的延迟分位数与吞吐量:
+
+python -m benchmark.load_test --spawn --concurrency 16 --requests 400
+"""
+
+
+class Client:
+    """
+    最小的 HTTP/1.1 keep-alive 客户端
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    async def request(self, method: str, path: str, body: bytes = b""):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        head = (f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(body)}\r\n"
+                f"Content-Type: application/json\r\n\r\n")
+        self.writer.write(head.encode("latin-1") + body)
+        await self.writer.drain()
+
+        lines = (await self.reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+        status = int(lines[0].split(" ", 2)[1])
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(":")
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+        data = await self.reader.readexactly(int(headers.get("content-length", "0")))
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return status, data
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+def percentile(values, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+async def user(client: Client, counter: dict, results: dict, verify_by: str):
+    while counter["left"] > 0:
+        counter["left"] -= 1
+
+        start = time.perf_counter()
+        status, data = await client.request("GET", "/challenge")
+        results["GET /challenge"].append(time.perf_counter() - start)
+        if status != 200:
+            results["errors"] += 1
+            continue
+
+        data = json.loads(data)
+        # 题目图像不能泄露答案（作弊模式的红色网格编号）
+        if challenge.has_answer_highlight(Image.open(io.BytesIO(base64.b64decode(data["image"])))):
+            results["highlighted"] += 1
+
+        body = json.dumps({verify_by: data[verify_by], "answer": "A1"}).encode("utf-8")
+        start = time.perf_counter()
+        status, _ = await client.request("POST", "/verify", body)
+        results["POST /verify"].append(time.perf_counter() - start)
+        if status != 200:
+            results["errors"] += 1
+
+
+async def run(host: str, port: int, concurrency: int, requests: int, verify_by: str = "id"):
+    """
+    :param requests: GET /challenge 请求数，每个请求之后都会验证一次
+    :param verify_by: "id" 按题目 id 验证，"token" 按无状态令牌验证
+    """
+
+    counter = {"left": requests}
+    results = {"GET /challenge": [], "POST /verify": [], "errors": 0, "highlighted": 0}
+    clients = [Client(host, port) for _ in range(concurrency)]
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(user(c, counter, results, verify_by) for c in clients))
+    finally:
+        for c in clients:
+            c.close()
+    return results, time.perf_counter() - start
+
+
+def report(results: dict, elapsed: float):
+    total = sum(len(v) for v in results.values() if isinstance(v, list))
+    print(f"{'endpoint':<16}{'n':>7}{'p50 ms':>10}{'p99 ms':>10}{'mean ms':>10}{'max ms':>10}")
+    for name, seconds in results.items():
+        if not isinstance(seconds, list) or not seconds:
+            continue
+        print(f"{name:<16}{len(seconds):>7}{percentile(seconds, 0.5) * 1000:>10.1f}"
+              f"{percentile(seconds, 0.99) * 1000:>10.1f}{statistics.mean(seconds) * 1000:>10.1f}"
+              f"{max(seconds) * 1000:>10.1f}")
+    print(f"{total} requests in {elapsed:.2f}s, {total / elapsed:.1f} requests/sec, "
+          f"{len(results['GET /challenge']) / elapsed:.1f} challenges/sec, {results['errors']} errors")
+    if results["highlighted"]:
+        print(f"{results['highlighted']} challenge images show the answer highlighted")
+
+
+async def wait_for_server(host: str, port: int, timeout: float):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test the ChiralGrid challenge server")
+    parser.add_argument("--url", default="http://127.0.0.1:8080", help="server address")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=200, help="number of challenges to request")
+    parser.add_argument("--spawn", action="store_true", help="start util.challenge_server for the test")
+    parser.add_argument("--workers", type=int, default=None, help="render processes of the spawned server")
+    parser.add_argument("--verify", choices=("id", "token"), default="id", help="verify by challenge id or token")
+    parser.add_argument("--warmup", type=float, default=0.0, help="seconds to wait after the spawned server is up")
+    args = parser.parse_args()
+
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+    server = None
+    if args.spawn:
+        cmd = [sys.executable, "-m", "util.challenge_server", "--host", host, "--port", str(port)]
+        if args.workers:
+            cmd += ["--workers", str(args.workers)]
+        server = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+    try:
+        if server is not None:
+            asyncio.run(wait_for_server(host, port, 60))
+            time.sleep(args.warmup)
+        results, elapsed = asyncio.run(run(host, port, args.concurrency, args.requests, args.verify))
+        report(results, elapsed)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    if results["errors"] or results["highlighted"]:
+        sys.exit(1)
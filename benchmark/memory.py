@@ -0,0 +1,60 @@
+import argparse
+import gc
+import os
+import tracemalloc
+
+import util
+from entity import molecule
+
+"""
+分子内存基准测试
+解析分子库中的分子并全部保留在内存中，统计每个分子、每个原子占用的内存:
+
+python -m benchmark.memory --limit 1000
+"""
+
+
+def measure(mol_dir: str, files):
+    """
+    :return: (分子数, 原子数, 化学键数, 总字节数, 源文本字节数)
+    """
+
+    sources = []
+    for f in files:
+        with open(os.path.join(mol_dir, f), "r", encoding="utf-8") as fh:
+            sources.append(fh.read())
+
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    molecules = [util.mdl_mol_parser.parse_string(src) for src in sources]
+    gc.collect()
+    total = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+
+    atoms = sum(len(m.atoms) for m in molecules)
+    bonds = sum(len(m.bonds) for m in molecules)
+    # 源文本与输入共享，不计入 total；单独列出以便估算保存源文本的开销
+    source_bytes = sum(len(src.encode("utf-8")) for src in sources)
+    return len(molecules), atoms, bonds, total, source_bytes
+
+
+def report(n, atoms, bonds, total, source_bytes):
+    print(f"molecules: {n}, atoms: {atoms}, bonds: {bonds}")
+    print(f"total: {total / 2 ** 20:.2f} MB (excluding {source_bytes / 2 ** 20:.2f} MB of MOL text)")
+    print(f"per molecule: {total / max(1, n) / 1024:.2f} KB")
+    print(f"per atom + bond: {total / max(1, atoms + bonds):.1f} B")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure memory used by parsed molecules")
+    parser.add_argument("--mol-dir", default="resource/mol", help="directory of .mol files")
+    parser.add_argument("--limit", type=int, default=0, help="number of molecules (0 for the whole corpus)")
+    args = parser.parse_args()
+
+    molecule.logger.level = util.logger.LEVEL_ERROR
+    files = sorted(f for f in os.listdir(args.mol_dir) if f.endswith(".mol"))
+    if args.limit > 0:
+        files = files[::max(1, len(files) // args.limit)][:args.limit]
+
+    report(*measure(args.mol_dir, files))
@@ -0,0 +1,71 @@
+import argparse
+import os
+import time
+
+import util
+from entity import molecule
+from util.mdl_mol_parser import MdlMolParser
+
+"""
+分子解析基准测试
+分别使用 parse_string（文本读取）、parse_file（二进制读取）与 parse_file(use_mmap=True) 解析分子库，统计吞吐量:
+
+python -m benchmark.parse --repeat 3
+"""
+
+
+def parse_text(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return MdlMolParser.parse_string(f.read())
+
+
+def parse_mmap(path):
+    return MdlMolParser.parse_file(path, use_mmap=True)
+
+
+PARSERS = {
+    "parse_string": parse_text,
+    "parse_file": MdlMolParser.parse_file,
+    "parse_file(mmap)": parse_mmap,
+}
+
+
+def bench(paths, parsers, repeat: int = 1):
+    """
+    :return: {parser: 最短耗时（秒）}
+    """
+
+    results = {}
+    for name in parsers:
+        parse = PARSERS[name]
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for path in paths:
+                parse(path)
+            best = min(best, time.perf_counter() - start)
+        results[name] = best
+    return results
+
+
+def report(results, n: int, total_bytes: int):
+    print(f"{'parser':<18}{'n':>6}{'total s':>10}{'mol/s':>10}{'MB/s':>8}")
+    for name, seconds in results.items():
+        print(f"{name:<18}{n:>6}{seconds:>10.2f}{n / seconds:>10.1f}{total_bytes / 2 ** 20 / seconds:>8.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark MDL MOL parsing throughput")
+    parser.add_argument("--mol-dir", default="resource/mol", help="directory of .mol files")
+    parser.add_argument("--limit", type=int, default=0, help="number of molecules (0 for the whole corpus)")
+    parser.add_argument("--repeat", type=int, default=1, help="report the best of N runs")
+    parser.add_argument("--parser", nargs="+", default=list(PARSERS), choices=list(PARSERS))
+    args = parser.parse_args()
+
+    molecule.logger.level = util.logger.LEVEL_ERROR
+    files = sorted(f for f in os.listdir(args.mol_dir) if f.endswith(".mol"))
+    if args.limit > 0:
+        files = files[::max(1, len(files) // args.limit)][:args.limit]
+    paths = [os.path.join(args.mol_dir, f) for f in files]
+
+    report(bench(paths, args.parser, args.repeat), len(paths), sum(os.path.getsize(p) for p in paths))
@@ -0,0 +1,71 @@
+import argparse
+import json
+import os
+import statistics
+import time
+
+import util
+from entity import molecule
+from entity.molecule import RENDER_QUALITY
+from util import challenge
+
+"""
+渲染质量基准测试
+对分子库中的分子分别以各个渲染质量渲染，统计耗时与画布内存:
+
+python -m benchmark.render_quality --limit 200
+"""
+
+
+def bench(mol_dir: str, files, qualities):
+    """
+    :return: {quality: {"seconds": [...], "canvas_bytes": [...]}}
+    """
+
+    params = challenge.render_params()
+    results = {q: {"seconds": [], "canvas_bytes": []} for q in qualities}
+    for f in files:
+        mol = util.mdl_mol_parser.parse_file(os.path.join(mol_dir, f))
+        mol.determine_min_max()
+        for q in qualities:
+            width, height, high_res_width, high_res_height = mol.get_render_size(RENDER_QUALITY[q][0])
+
+            start = time.perf_counter()
+            mol.render_molecule(**dict(params, quality=q))
+            results[q]["seconds"].append(time.perf_counter() - start)
+            # RGBA 画布与缩小后的输出图像
+            results[q]["canvas_bytes"].append((high_res_width * high_res_height + width * height) * 4)
+    return results
+
+
+def report(results):
+    print(f"{'quality':<10}{'n':>6}{'total s':>10}{'mean ms':>10}{'p95 ms':>10}{'mol/s':>9}"
+          f"{'mean MB':>10}{'peak MB':>10}")
+    for q, r in results.items():
+        seconds, canvas = r["seconds"], r["canvas_bytes"]
+        if not seconds:
+            continue
+        p95 = sorted(seconds)[min(len(seconds) - 1, int(len(seconds) * 0.95))]
+        print(f"{q:<10}{len(seconds):>6}{sum(seconds):>10.2f}{statistics.mean(seconds) * 1000:>10.1f}"
+              f"{p95 * 1000:>10.1f}{len(seconds) / sum(seconds):>9.2f}"
+              f"{statistics.mean(canvas) / 2 ** 20:>10.1f}{max(canvas) / 2 ** 20:>10.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark render quality tiers")
+    parser.add_argument("--mol-dir", default="resource/mol", help="directory of .mol files")
+    parser.add_argument("--limit", type=int, default=100, help="number of molecules (0 for the whole corpus)")
+    parser.add_argument("--quality", nargs="+", default=list(RENDER_QUALITY), choices=list(RENDER_QUALITY))
+    parser.add_argument("--json", default=None, help="write raw results to this file")
+    args = parser.parse_args()
+
+    molecule.logger.level = util.logger.LEVEL_ERROR
+    files = sorted(f for f in os.listdir(args.mol_dir) if f.endswith(".mol"))
+    if args.limit > 0:
+        files = files[::max(1, len(files) // args.limit)][:args.limit]
+
+    results = bench(args.mol_dir, files, args.quality)
+    report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f)
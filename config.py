@@ -1,3 +1,5 @@
+import os
+
 from util import logger
 
 # ** 渲染设置 **
@@ -20,9 +22,68 @@ dpi = 500
 # 控制网格大小，当此项为 0 或小于 0 时则不渲染网格
 base_grid_size = 800
 
+# 渲染质量（超采样倍数与缩小滤波器）
+# "fast": 1 倍，双线性；"balanced": 1.5 倍，双三次；"high": 2.5 倍，Lanczos
+render_quality = "high"
+
+# 绘制画布（超采样后）的最大像素数，超出时整体缩小布局，防止大分子占用过多内存；0 表示不限制
+# RGBA 画布每像素 4 字节，64000000 约为 256 MB
+max_pixels = 64000000
+
+# 输出图像的目标宽高，布局按比例缩放至恰好放入该尺寸；0 表示按分子大小决定
+target_width = 0
+target_height = 0
+
+# 手性碳检测引擎
+# "recursive": 逐原子递归比较取代基链（原实现）
+# "symmetry": 整分子一次性计算原子对称类，速度更快（全库约快 30%），结果也更准确：
+#             递归比较在 676 个分子上误判（如 1028.mol 的 11 号原子），对称类不会
+chiral_mode = "recursive"
+
+# ** 题库设置 **
+# 分子库索引文件，由 `python -m util.corpus_index` 生成；不存在时退回逐个尝试的方式抽题
+mol_index_path = "resource/mol_index.json"
+
+# 预解析分子库，由 `python -m util.mol_pack` 生成；存在时通过 mmap 直接读取分子，不存在时逐个解析 .mol 文件
+mol_pack_path = "resource/mol.pack"
+
+# 进程内缓存的已解析分子数，热门分子只解析一次
+molecule_cache_size = 256
+
+# 渲染结果缓存：以分子内容与渲染参数的哈希为键保存渲染结果与网格数据，超出字节预算时淘汰最久未使用的结果
+# 磁盘中保存 PNG，内存中保存解码后的图像（按像素数据计入预算）；预算分别为 0 时关闭对应的缓存
+render_cache_dir = "cache/render"
+render_cache_max_bytes = 512 * 1024 * 1024
+render_cache_memory_bytes = 64 * 1024 * 1024
+
+# 按难度筛选题目：最少/最多手性碳数、最多原子数，0 表示不限制
+min_chiral_count = 1
+max_chiral_count = 0
+max_atom_count = 0
+
+# ** 题目服务设置 **（`python -m util.challenge_server`）
+server_host = "127.0.0.1"
+server_port = 8080
+# 题目有效期（秒）与最多保存的未验证题目数
+challenge_ttl = 300
+challenge_store_size = 100000
+# 预先渲染备用的题目数，0 表示收到请求时才渲染
+server_prefetch = 8
+# 读取请求头、请求体各自的超时时间（秒），超时后关闭连接，避免慢速发送请求的连接一直占用服务；0 表示不限制
+server_read_timeout = 10
+# 题目令牌的签名密钥，多个节点共享同一密钥即可互相验证答案；为空时每次启动随机生成
+challenge_secret = os.environ.get("CHIRALGRID_SECRET", "")
+
+# ** 界面设置 **
+# 后台预生成的题目数，为 0 时每次换题都在界面线程中同步生成
+prefetch_depth = 2
+
 # ** 日志与数据持久化设置 **
 # 设置日志等级
 log_level = logger.LEVEL_DEBUG
 
 # 是否保存网格数据
 save_grid = True
+
+# 是否保存渲染的图像（在后台线程中写入 result/）
+save_image = True
@@ -1,5 +1,7 @@
 from . import molecule
+from . import grid
 
 Atom = molecule.Atom
 Bond = molecule.Bond
 Molecule = molecule.Molecule
+GridIndex = grid.GridIndex
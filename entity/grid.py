@@ -0,0 +1,99 @@
+import math
+from typing import Dict, List, Optional, Tuple
+
+
+def grid_row_label(row: int) -> str:
+    """
+    行编号转换为字母: 0 -> A, 25 -> Z, 26 -> AA, 27 -> AB ...
+    """
+
+    label = ""
+    row += 1
+    while row > 0:
+        row, rem = divmod(row - 1, 26)
+        label = chr(65 + rem) + label
+    return label
+
+
+class GridIndex:
+    """
+    渲染网格的索引，按 (row, col) 直接定位单元格，并记录原子与单元格的对应关系
+    """
+
+    def __init__(self, width: float, height: float, size: float):
+        self.size = size
+        self.rows = math.ceil(height / size)
+        self.cols = math.ceil(width / size)
+
+        self.atom_cells: List[Optional[Tuple[int, int]]] = []  # 原子 -> 单元格
+        self.cell_atoms: Dict[Tuple[int, int], List[tuple]] = {}  # 单元格 -> 原子信息
+
+    def cell_id(self, row: int, col: int) -> str:
+        return f"{grid_row_label(row)}{col + 1}"
+
+    def cell_box(self, row: int, col: int):
+        """
+        :return: (x0, y0, x1, y1)
+        """
+
+        x0, y0 = col * self.size, row * self.size
+        return x0, y0, x0 + self.size, y0 + self.size
+
+    @staticmethod
+    def cell_bg(row: int, col: int) -> str:
+        return "lightgray" if (row + col) % 2 == 1 else "white"
+
+    def cells(self):
+        for row in range(self.rows):
+            for col in range(self.cols):
+                yield row, col
+
+    def locate(self, x: float, y: float) -> Optional[Tuple[int, int]]:
+        """
+        获取坐标所在的单元格，不在网格内时返回 None
+        """
+
+        row = self._locate_axis(y, self.rows)
+        col = self._locate_axis(x, self.cols)
+        if row is None or col is None:
+            return None
+        return row, col
+
+    def _locate_axis(self, v: float, count: int) -> Optional[int]:
+        n = int(v // self.size)
+        # 与单元格边界 [n * size, n * size + size) 的比较结果保持一致，修正浮点误差
+        if n * self.size > v:
+            n -= 1
+        elif n * self.size + self.size <= v:
+            n += 1
+        return n if 0 <= n < count else None
+
+    def add_atom(self, cell: Optional[Tuple[int, int]], elem: Optional[tuple] = None):
+        """
+        按原子顺序记录原子所在的单元格
+
+        :param elem: 写入网格数据的原子信息，为 None 时只记录单元格
+        """
+
+        self.atom_cells.append(cell)
+        if cell is not None and elem is not None:
+            self.cell_atoms.setdefault(cell, []).append(elem)
+
+    def to_dict(self) -> dict:
+        """
+        转换为网格数据: {"A1": {"x0", "y0", "x1", "y1", "bg"}, "A1.elems": [...], ...}
+        """
+
+        grid_data = {}
+        for row, col in self.cells():
+            grid_id = self.cell_id(row, col)
+            x0, y0, x1, y1 = self.cell_box(row, col)
+            grid_data[f"{grid_id}.elems"] = self.cell_atoms.get((row, col), [])
+            grid_data[grid_id] = {
+                "x0": x0,
+                "y0": y0,
+                "x1": x1,
+                "y1": y1,
+                "bg": self.cell_bg(row, col),
+            }
+        return grid_data
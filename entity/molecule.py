@@ -1,15 +1,36 @@
 import math
-from typing import List, Optional
+import time
+from array import array
+from typing import Dict, FrozenSet, List, Optional, Tuple
 
+import config
 from config import log_level
 from util import logger
 
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
 
 from util import chiral_carbon_helper
+from util.glyph_cache import get_font, draw_text
+from entity.grid import GridIndex
 
 logger = logger.Logger(log_level, "ChiralGrid-log.txt")
 
+# 渲染质量: 名称 -> (超采样倍数, 缩小时使用的重采样滤波器)
+# 字体、线宽、留白与网格等像素尺寸均以 high 为基准按超采样倍数缩放，不同质量下的布局与网格一致
+RENDER_QUALITY = {
+    "fast": (1.0, Image.BILINEAR),
+    "balanced": (1.5, Image.BICUBIC),
+    "high": (2.5, Image.LANCZOS),
+}
+
+# 计算隐式氢原子数的价态表: 元素 -> (价态, 是否按电荷绝对值扣减)，否则价态加上电荷
+IMPLICIT_VALENCE = {
+    "C": (4, True),
+    "O": (2, False), "S": (2, False),
+    "N": (3, False), "P": (3, False),
+    "F": (1, True), "Cl": (1, True), "Br": (1, True), "I": (1, True),
+}
+
 
 def convert_ion(text):
     normal_chars = "0123456789+-"
@@ -25,6 +46,9 @@ class Atom:
     定义原子的基本属性
     """
 
+    __slots__ = ("charge", "element", "show_flag", "hydrogen_count", "spare_space", "isotope", "mapnum", "unpaired",
+                 "_coords", "_index", "_extra")
+
     def __init__(self, charge: int = 0, element: str = "", show_flag: int = 0,
                  hydrogen_count: int = 0, spare_space: int = 0, isotope: int = 0,
                  mapnum: int = 0, unpaired: int = 0, x: float = 0.0, y: float = 0.0,
@@ -38,13 +62,54 @@ class Atom:
         self.mapnum = mapnum  # 映射编号, 在合成路线追踪中有用
         self.unpaired = unpaired  # 未配对的电子数
 
-        # 原子坐标
-        self.x = x
-        self.y = y
-        self.z = z
+        # 原子坐标，保存在坐标数组中: 加入分子后指向分子的 xs、ys、zs，否则为独立的单元素列表
+        self._coords = ([x], [y], [z])
+        self._index = 0
+
+        # 额外信息 默认为空，首次访问时才创建列表
+        self._extra = extra
+
+    @property
+    def extra(self) -> List[str]:
+        if self._extra is None:
+            self._extra = []
+        return self._extra
+
+    @extra.setter
+    def extra(self, value: List[str]):
+        self._extra = value
+
+    @property
+    def x(self) -> float:
+        return self._coords[0][self._index]
+
+    @x.setter
+    def x(self, value: float):
+        self._coords[0][self._index] = value
+
+    @property
+    def y(self) -> float:
+        return self._coords[1][self._index]
 
-        # 额外信息 默认为空
-        self.extra = extra if extra is not None else []
+    @y.setter
+    def y(self, value: float):
+        self._coords[1][self._index] = value
+
+    @property
+    def z(self) -> float:
+        return self._coords[2][self._index]
+
+    @z.setter
+    def z(self, value: float):
+        self._coords[2][self._index] = value
+
+    def bind_coords(self, coords, index: int):
+        """
+        将原子坐标绑定到坐标数组 (xs, ys, zs) 的第 index 项
+        """
+
+        self._coords = coords
+        self._index = index
 
 
 class Bond:
@@ -52,6 +117,8 @@ class Bond:
     定义化学键的基本属性
     """
 
+    __slots__ = ("from_atom", "to", "type", "stereo_direction", "_extra")
+
     def __init__(self, from_atom: int = 0, to: int = 0, type_: int = 0,
                  stereo_direction: int = 0, extra: Optional[List[str]] = None):
         self.from_atom = from_atom  # 起始端点
@@ -60,7 +127,17 @@ class Bond:
 
         # 键的方向 默认为 0(DIRECTION_UNSPECIFIED)
         self.stereo_direction = stereo_direction
-        self.extra = extra if extra is not None else []
+        self._extra = extra  # 额外信息 默认为空，首次访问时才创建列表
+
+    @property
+    def extra(self) -> List[str]:
+        if self._extra is None:
+            self._extra = []
+        return self._extra
+
+    @extra.setter
+    def extra(self, value: List[str]):
+        self._extra = value
 
 
 class Molecule:
@@ -78,7 +155,11 @@ class Molecule:
     DIRECTION_LEFT = 4  # 指向左边
     DIRECTION_RIGHT = 8  # 指向右边
 
-    def __init__(self, cid: int, atoms: List[Atom], bonds: List[Bond], mdl_mol_str: str):
+    def __init__(self, cid: int, atoms: List[Atom], bonds: List[Bond], mdl_mol_str: str, coords=None):
+        """
+        :param coords: 可选的坐标数组 (xs, ys, zs)，与 atoms 一一对应，为 None 时从原子中读取
+        """
+
         self.draw = None
         self.cid = cid
         self.atoms = atoms
@@ -92,8 +173,140 @@ class Molecule:
         self.min_y = 0.0
 
         self.inval_min_max = True  # 坐标范围无效
+        self.inval_geometry = True  # 线性碳、spare_space 与平均键长无效，见 init_geometry
         self.avg_bond_length = 0.0  # 平均键长
 
+        # 原子坐标数组，Atom 的 x、y、z 为其中对应项的视图
+        self.xs = array('d')
+        self.ys = array('d')
+        self.zs = array('d')
+        self.coords = (self.xs, self.ys, self.zs)
+        self.bind_coords(coords)
+
+        # 邻接索引，首次访问时构建，原子或化学键变化后失效
+        self.inval_index = True
+        self._atom_bond_ids: List[List[int]] = []  # 原子 -> 关联键的索引
+        self._atom_neighbors: List[List[int]] = []  # 原子 -> 相邻原子的索引
+        self._atom_ids: Dict[int, int] = {}  # id(Atom) -> 原子索引
+        self._bond_ids: Dict[int, int] = {}  # id(Bond) -> 键索引
+
+        # 手性检测的中间结果缓存，原子或化学键变化后清空
+        self.chiral_cache: Dict[str, dict] = {}
+
+    def build_index(self):
+        """
+        构建原子与化学键的邻接索引，只需遍历一次所有化学键
+        """
+
+        # 先在局部变量中构建，最后再发布，其他线程不会读到构建了一半的索引
+        atom_bond_ids = [[] for _ in self.atoms]
+        atom_neighbors = [[] for _ in self.atoms]
+        bond_ids = {}
+        for n, b in enumerate(self.bonds, start=1):
+            bond_ids[id(b)] = n
+            if 1 <= b.from_atom <= len(self.atoms):
+                atom_bond_ids[b.from_atom - 1].append(n)
+                atom_neighbors[b.from_atom - 1].append(b.to)
+            if 1 <= b.to <= len(self.atoms) and b.to != b.from_atom:
+                atom_bond_ids[b.to - 1].append(n)
+                atom_neighbors[b.to - 1].append(b.from_atom)
+
+        self._atom_bond_ids = atom_bond_ids
+        self._atom_neighbors = atom_neighbors
+        self._atom_ids = {id(a): i + 1 for i, a in enumerate(self.atoms)}
+        self._bond_ids = bond_ids
+        self.inval_index = False
+
+    def bind_coords(self, coords=None):
+        """
+        按当前的原子列表重建坐标数组，并将每个原子的坐标绑定到数组中
+
+        :param coords: 直接使用的坐标数组 (xs, ys, zs)，为 None 时从原子中读取
+        """
+
+        if coords is None:
+            coords = (array('d', (a.x for a in self.atoms)), array('d', (a.y for a in self.atoms)),
+                      array('d', (a.z for a in self.atoms)))
+        # 所有原子共享同一个 (xs, ys, zs) 元组
+        self.coords = coords = tuple(coords)
+        self.xs, self.ys, self.zs = coords
+        for i, a in enumerate(self.atoms):
+            a.bind_coords(coords, i)
+
+    def invalidate(self):
+        """
+        使依赖于原子、化学键的缓存失效
+        直接修改 atoms、bonds 列表或键的端点后需要调用
+        """
+
+        if len(self.xs) != len(self.atoms) or any(a._coords[0] is not self.xs or a._index != i
+                                                  for i, a in enumerate(self.atoms)):
+            self.bind_coords()
+        self._invalidate_caches()
+
+    def _invalidate_caches(self):
+        self.inval_index = True
+        self.inval_min_max = True
+        self.inval_geometry = True
+        self.chiral_cache.clear()
+
+    def add_atom(self, atom: Atom) -> int:
+        """
+        添加原子
+        :return: 新原子的索引
+        """
+
+        x, y, z = atom.x, atom.y, atom.z
+        self.atoms.append(atom)
+        self.xs.append(x)
+        self.ys.append(y)
+        self.zs.append(z)
+        atom.bind_coords(self.coords, len(self.atoms) - 1)
+        self._invalidate_caches()
+        return len(self.atoms)
+
+    def add_bond(self, bond: Bond) -> int:
+        """
+        添加化学键
+        :return: 新化学键的索引
+        """
+
+        if bond.from_atom < 1 or bond.from_atom > len(self.atoms) or bond.to < 1 or bond.to > len(self.atoms):
+            raise IndexError(f"Bonds: invalid endpoints {bond.from_atom}-{bond.to}, numAtoms={len(self.atoms)}")
+        self.bonds.append(bond)
+        self._invalidate_caches()
+        return len(self.bonds)
+
+    def remove_bond(self, n: int) -> Bond:
+        """
+        删除指定索引的化学键，之后的化学键索引前移
+        """
+
+        bond = self.get_bond(n)
+        del self.bonds[n - 1]
+        self._invalidate_caches()
+        return bond
+
+    def remove_atom(self, n: int) -> Atom:
+        """
+        删除指定索引的原子及其关联的化学键，并重新编号其余键的端点
+        """
+
+        atom = self.get_atom(n)
+        del self.atoms[n - 1]
+        bonds = []
+        for b in self.bonds:
+            if b.from_atom == n or b.to == n:
+                continue
+            if b.from_atom > n:
+                b.from_atom -= 1
+            if b.to > n:
+                b.to -= 1
+            bonds.append(b)
+        self.bonds[:] = bonds
+        self.invalidate()
+        return atom
+
     def determine_min_max(self):
         """
         确定分子中所有原子的最大和最小坐标值
@@ -103,17 +316,8 @@ class Molecule:
         if not self.atoms:
             self.max_y = self.min_y = self.max_x = self.min_x = 0.0
             return
-        atom_x = self.atom_x(1)
-        self.max_x = self.min_x = atom_x
-        atom_y = self.atom_y(1)
-        self.max_y = self.min_y = atom_y
-        for n in range(2, len(self.atoms) + 1):
-            x = self.atom_x(n)
-            y = self.atom_y(n)
-            self.min_x = min(self.min_x, x)
-            self.max_x = max(self.max_x, x)
-            self.min_y = min(self.min_y, y)
-            self.max_y = max(self.max_y, y)
+        self.min_x, self.max_x = min(self.xs), max(self.xs)
+        self.min_y, self.max_y = min(self.ys), max(self.ys)
 
     def get_atom(self, n):
         """
@@ -150,8 +354,8 @@ class Molecule:
             return -1
         closest_index = 1
         min_distance = float("inf")
-        for i, atom in enumerate(self.atoms):
-            dist = (atom.x - x) ** 2 + (atom.y - y) ** 2
+        for i, (ax, ay) in enumerate(zip(self.xs, self.ys)):
+            dist = (ax - x) ** 2 + (ay - y) ** 2
             if dist < min_distance:
                 closest_index = i + 1
                 min_distance = dist
@@ -173,13 +377,15 @@ class Molecule:
 
     # ------------------- 获取指定原子的坐标值 -------------------
     def atom_x(self, index):
-        return self.atoms[index - 1].x
+        return self.xs[index - 1]
 
     def atom_y(self, index):
-        return self.atoms[index - 1].y
+        return self.ys[index - 1]
 
     def atom_z(self, n: int) -> float:
-        return self.get_atom(n).z
+        if n < 1 or n > len(self.atoms):
+            raise IndexError(f"Atoms: get {n}, numAtoms={len(self.atoms)}")
+        return self.zs[n - 1]
 
     # ------------------- 获取分子在 X 轴和 Y 轴上的跨度 -------------------
     def range_x(self) -> float:
@@ -212,16 +418,16 @@ class Molecule:
     # ------------------- 获取原子或化学键在列表中的索引 -------------------
 
     def get_atom_id(self, atom: Atom) -> int:
-        for i, a in enumerate(self.atoms):
-            if atom == a:
-                return i + 1
-        return -1
+        if self.inval_index:
+            self.build_index()
+        n = self._atom_ids.get(id(atom), -1)
+        return n if n > 0 and self.atoms[n - 1] is atom else -1
 
     def get_bond_id(self, bond: Bond) -> int:
-        for i, b in enumerate(self.bonds):
-            if bond == b:
-                return i + 1
-        return -1
+        if self.inval_index:
+            self.build_index()
+        n = self._bond_ids.get(id(bond), -1)
+        return n if n > 0 and self.bonds[n - 1] is bond else -1
 
     # --------------------------------------------------
 
@@ -238,20 +444,62 @@ class Molecule:
         if atom_index < 1 or atom_index > len(self.atoms):
             raise IndexError(f"Invalid atom index: {atom_index}. Must be between test and {len(self.atoms)}")
 
-        ret = []
-        for b in self.bonds:
-            if b.from_atom == atom_index or b.to == atom_index:
-                ret.append(b)
+        return [self.bonds[n - 1] for n in self.get_atom_declared_bond_ids(atom_index)]
+
+    def get_atom_declared_bond_ids(self, atom_index: int) -> List[int]:
+        """
+        获取指定原子所关联的所有键的索引，顺序与 bonds 列表一致
+        返回的列表属于邻接索引，请勿修改
+        """
+
+        if atom_index < 1 or atom_index > len(self.atoms):
+            raise IndexError(f"Invalid atom index: {atom_index}. Must be between test and {len(self.atoms)}")
+        if self.inval_index:
+            self.build_index()
+        return self._atom_bond_ids[atom_index - 1]
+
+    def get_atom_neighbors(self, atom_index: int) -> List[int]:
+        """
+        获取与指定原子相连的所有原子的索引，顺序与 get_atom_declared_bond_ids 一致
+        """
 
+        if atom_index < 1 or atom_index > len(self.atoms):
+            raise IndexError(f"Invalid atom index: {atom_index}. Must be between test and {len(self.atoms)}")
+        if self.inval_index:
+            self.build_index()
+        return self._atom_neighbors[atom_index - 1]
+
+    def get_atom_degree(self, atom_index: int) -> int:
+        """
+        获取指定原子所关联的键数
+        """
+
+        return len(self.get_atom_declared_bond_ids(atom_index))
+
+    def get_chiral_carbons(self, mode: str = None) -> FrozenSet[int]:
+        """
+        获取分子中所有手性碳的索引，结果按检测引擎缓存，原子或化学键变化后失效
+
+        :param mode: 手性碳检测引擎，默认使用 config.chiral_mode
+        """
+
+        # 调用时读取 config，与渲染缓存键中的引擎保持一致
+        mode = mode or config.chiral_mode
+        key = f"chiral_carbons.{mode}"
+        ret = self.chiral_cache.get(key)
+        if ret is None:
+            ret = self.chiral_cache[key] = frozenset(chiral_carbon_helper.get_molecule_chiral_carbons(self, mode))
         return ret
 
     def get_average_bond_length(self) -> float:
         """
         返回分子的平均键长
         """
+
+        self.init_geometry()
         return self.avg_bond_length
 
-    def draw_bond(self, atom1, atom2, bond_type, scale, offset_x, offset_y, line_width):
+    def draw_bond(self, atom1, atom2, bond_type, scale, offset_x, offset_y, line_width, draw=None):
         """
         绘制化学键
 
@@ -262,100 +510,252 @@ class Molecule:
         :param offset_x: x轴偏移量
         :param offset_y: y轴偏移量
         :param line_width: 线条宽度
+        :param draw: 绘制目标，默认为 self.draw
         """
 
-        start_x = int(atom1.x * scale + offset_x)
-        start_y = int(atom1.y * scale + offset_y)
-        end_x = int(atom2.x * scale + offset_x)
-        end_y = int(atom2.y * scale + offset_y)
+        self.draw_bond_line(int(atom1.x * scale + offset_x), int(atom1.y * scale + offset_y),
+                            int(atom2.x * scale + offset_x), int(atom2.y * scale + offset_y), bond_type, line_width,
+                            draw)
 
-        rad = math.atan2(end_y - start_y, end_x - start_x)
-        delta = line_width / 6
-        dx = math.sin(rad) * delta * 10
-        dy = math.cos(rad) * delta * 10
+    def draw_bond_line(self, start_x, start_y, end_x, end_y, bond_type, line_width, draw=None):
+        """
+        按屏幕坐标绘制化学键
+
+        :param draw: 绘制目标，默认为 self.draw
+        """
+
+        draw = draw if draw is not None else self.draw
+        if bond_type == 1:  # 单键，不需要平行线的偏移
+            draw.line((start_x, start_y, end_x, end_y), fill="black", width=line_width)
+            return
+
+        # 平行线沿键的法向偏移 line_width / 6 * 10，由键向量归一化得到，无需三角函数
+        vx, vy = end_x - start_x, end_y - start_y
+        length = math.hypot(vx, vy)
+        offset = line_width / 6 * 10
+        dx, dy = (vy / length * offset, vx / length * offset) if length else (0.0, offset)
 
         w1 = int(line_width * 0.8)
 
-        if bond_type == 1:  # 单键
-            self.draw.line((start_x, start_y, end_x, end_y), fill="black", width=line_width)
-        elif bond_type == 2:  # 双键
-            self.draw.line((start_x + dx / 2, start_y - dy / 2, end_x + dx / 2, end_y - dy / 2), fill="black",
-                           width=w1)
-            self.draw.line((start_x - dx / 2, start_y + dy / 2, end_x - dx / 2, end_y + dy / 2), fill="black",
-                           width=w1)
+        if bond_type == 2:  # 双键
+            draw.line((start_x + dx / 2, start_y - dy / 2, end_x + dx / 2, end_y - dy / 2), fill="black",
+                      width=w1)
+            draw.line((start_x - dx / 2, start_y + dy / 2, end_x - dx / 2, end_y + dy / 2), fill="black",
+                      width=w1)
         elif bond_type == 3:  # 三键
-            self.draw.line((start_x, start_y, end_x, end_y), fill="black", width=w1)
-            self.draw.line((start_x + dx, start_y - dy, end_x + dx, end_y - dy), fill="black", width=w1)
-            self.draw.line((start_x - dx, start_y + dy, end_x - dx, end_y + dy), fill="black", width=w1)
+            draw.line((start_x, start_y, end_x, end_y), fill="black", width=w1)
+            draw.line((start_x + dx, start_y - dy, end_x + dx, end_y - dy), fill="black", width=w1)
+            draw.line((start_x - dx, start_y + dy, end_x - dx, end_y + dy), fill="black", width=w1)
         else:
             raise ValueError("Unknown bond type:", bond_type)
 
+    def declutter_atoms(self, scale, offset_x, offset_y, padding, xs=None, ys=None):
+        """
+        移开屏幕坐标过近的原子，防止元素符号重叠
+
+        与逐对比较所有原子的结果一致：按 (i, j) 的顺序处理，但借助边长为 padding 的均匀网格，
+        只检查相邻网格中的原子；每次调整后重新查询 i 的邻居
+
+        :param padding: 两个原子在 x、y 方向上的屏幕距离都小于该值时视为重叠
+        :param xs: 要调整的 x 坐标数组，默认直接调整分子自身的坐标
+        :param ys: 要调整的 y 坐标数组，默认直接调整分子自身的坐标
+        """
+
+        if padding <= 0:
+            return
+
+        atoms = self.atoms
+        mol_xs = xs if xs is not None else self.xs
+        mol_ys = ys if ys is not None else self.ys
+        xs = [int(x * scale + offset_x) for x in mol_xs]
+        ys = [int(y * scale + offset_y) for y in mol_ys]
+        cells = [(x // padding, y // padding) for x, y in zip(xs, ys)]
+        buckets: Dict[tuple, set] = {}
+        for k, cell in enumerate(cells):
+            buckets.setdefault(cell, set()).add(k)
+
+        def neighbours(k, after):
+            cx, cy = cells[k]
+            return sorted(n for gx in (cx - 1, cx, cx + 1) for gy in (cy - 1, cy, cy + 1)
+                          for n in buckets.get((gx, gy), ()) if n > after)
+
+        def move(k):
+            xs[k] = int(mol_xs[k] * scale + offset_x)
+            ys[k] = int(mol_ys[k] * scale + offset_y)
+            cell = (xs[k] // padding, ys[k] // padding)
+            if cell != cells[k]:
+                buckets[cells[k]].discard(k)
+                buckets.setdefault(cell, set()).add(k)
+                cells[k] = cell
+
+        for i, atom_i in enumerate(atoms):
+            after = i
+            candidates = neighbours(i, after)
+            while candidates:
+                j = candidates.pop(0)
+                xi, yi, xj, yj = xs[i], ys[i], xs[j], ys[j]
+                if not (abs(xi - xj) < padding and abs(yi - yj) < padding):
+                    continue
+
+                atom_j = atoms[j]
+                logger.warning(
+                    "Element symbols are too close: Atom %s at (%s, %s) and Atom %s at (%s, %s). "
+                    "Adjusting positions..",
+                    atom_i.element, mol_xs[i], mol_ys[i], atom_j.element, mol_xs[j], mol_ys[j])
+
+                dx = (padding - abs(xi - xj)) // 2
+                dy = (padding - abs(yi - yj)) // 2
+
+                if xi < xj:
+                    mol_xs[i] -= dx / scale
+                    mol_xs[j] += dx / scale
+                else:
+                    mol_xs[i] += dx / scale
+                    mol_xs[j] -= dx / scale
+
+                if yi < yj:
+                    mol_ys[i] -= dy / scale
+                    mol_ys[j] += dy / scale
+                else:
+                    mol_ys[i] += dy / scale
+                    mol_ys[j] -= dy / scale
+
+                logger.info(
+                    "Adjusted over: Atom %s at (%s, %s) and Atom %s at (%s, %s). ",
+                    atom_i.element, mol_xs[i], mol_ys[i], atom_j.element, mol_xs[i], mol_ys[i])
+
+                move(i)
+                move(j)
+                after = j
+                candidates = neighbours(i, after)
+
     def init_once(self):
         """
-        初始化分子的一些属性
+        初始化分子的一些属性：只遍历一次化学键，按价态表确定各原子的隐式氢原子数
+        线性碳、spare_space 与平均键长等几何属性在首次使用时由 init_geometry 计算
         """
 
         logger.info("Initializing molecular properties...")
 
+        atoms = self.atoms
+        n = len(atoms)
+        bond_type_sums = [0] * n
+        for b in self.bonds:
+            if 1 <= b.from_atom <= n:
+                bond_type_sums[b.from_atom - 1] += b.type
+            if 1 <= b.to <= n and b.to != b.from_atom:
+                bond_type_sums[b.to - 1] += b.type
+
         # 确定原子的氢原子数
-        for i, atom in enumerate(self.atoms):
-            bonds = self.get_atom_declared_bonds(i + 1)
-            bond_type_sum = sum(b.type for b in bonds)
-            logger.debug(f"bond_type_sum: {bond_type_sum}")
+        for atom, bond_type_sum in zip(atoms, bond_type_sums):
             if atom.hydrogen_count == 0:
-                if atom.element == "C":
-                    atom.hydrogen_count = max(0, 4 - atom.unpaired - abs(atom.charge) - bond_type_sum)
-                elif atom.element in {"O", "S"}:
-                    atom.hydrogen_count = max(0, 2 - atom.unpaired + atom.charge - bond_type_sum)
-                elif atom.element in {"N", "P"}:
-                    atom.hydrogen_count = max(0, 3 - atom.unpaired + atom.charge - bond_type_sum)
-                elif atom.element in {"F", "Cl", "Br", "I"}:
-                    atom.hydrogen_count = max(0, 1 - atom.unpaired - abs(atom.charge) - bond_type_sum)
+                valence = IMPLICIT_VALENCE.get(atom.element)
+                if valence is not None:
+                    base, abs_charge = valence
+                    charge = -abs(atom.charge) if abs_charge else atom.charge
+                    atom.hydrogen_count = max(0, base - atom.unpaired + charge - bond_type_sum)
+
+        self.inval_geometry = True
+
+    def init_geometry(self):
+        """
+        计算依赖于坐标的属性：线性碳的显式标志、各原子的 spare_space 方向标志与平均键长
+        只在首次使用（渲染、get_average_bond_length）时计算一次，原子或化学键变化后重新计算
+        """
+
+        if not self.inval_geometry:
+            return
+
+        xs, ys = self.xs, self.ys
+        atoms = self.atoms
+        n = len(atoms)
+        pi, two_pi, half_pi = math.pi, 2 * math.pi, math.pi / 2
 
+        # 只遍历一次化学键：每个键的两个方向各计算一次 atan2，同时累计两端原子各方向上最近的键与键长
+        right, left, bottom = [two_pi] * n, [two_pi] * n, [two_pi] * n
+        reverse_angles = [[] for _ in atoms]  # 原子 -> 各关联键由 to 指向 from 的方向，用于判断线性碳
+        total_length = 0.0
+        for b in self.bonds:
+            f, t = b.from_atom - 1, b.to - 1
+            vx, vy = xs[t] - xs[f], ys[t] - ys[f]
+            total_length += math.hypot(vx, vy)
+            reverse = math.atan2(ys[f] - ys[t], xs[f] - xs[t])  # 不能写成 atan2(-vy, -vx)，水平的键会得到 -0.0
+            reverse_angles[f].append(reverse)
+            reverse_angles[t].append(reverse)
+            # 从原子指向键另一端的方向
+            for i, dt in ((f, math.atan2(vy, vx)), (t, reverse)):
+                a = abs(dt) % two_pi
+                if a < right[i]:
+                    right[i] = a
+                a = min(abs(dt - pi), abs(dt + pi)) % two_pi
+                if a < left[i]:
+                    left[i] = a
+                a = abs(dt + half_pi) % two_pi
+                if a < bottom[i]:
+                    bottom[i] = a
+
+        for i, atom in enumerate(atoms):
             # 设置碳原子的显式标志
-            if atom.element == "C":
-                if len(bonds) == 2:  # 双键
-                    t1 = math.atan2(self.atom_y(bonds[0].from_atom) - self.atom_y(bonds[0].to),
-                                    self.atom_x(bonds[0].from_atom) - self.atom_x(bonds[0].to))
-                    t2 = math.atan2(self.atom_y(bonds[1].from_atom) - self.atom_y(bonds[1].to),
-                                    self.atom_x(bonds[1].from_atom) - self.atom_x(bonds[1].to))
-                    if t1 < 0:
-                        t1 += math.pi
-                    if t2 < 0:
-                        t2 += math.pi
-                    if abs(t1 - t2) < 10 / 360 * 2 * math.pi:  # 方向相同
-                        logger.debug(f"{atom} is a linear carbon")
-                        atom.show_flag |= Molecule.SHOW_FLAG_EXPLICIT
+            if atom.element == "C" and len(reverse_angles[i]) == 2:  # 双键
+                t1, t2 = reverse_angles[i]
+                if t1 < 0:
+                    t1 += pi
+                if t2 < 0:
+                    t2 += pi
+                if abs(t1 - t2) < 10 / 360 * two_pi:  # 方向相同
+                    logger.debug("%s is a linear carbon", atom)
+                    atom.show_flag |= Molecule.SHOW_FLAG_EXPLICIT
 
             # 确定原子的 spare_space 方向标志
-            top = bottom = left = right = 2 * math.pi
-            for b in bonds:
-                x1, y1 = self.atom_x(i + 1), self.atom_y(i + 1)
-                x2, y2 = (self.atom_x(b.to), self.atom_y(b.to)) if b.from_atom == i + 1 else \
-                    (self.atom_x(b.from_atom), self.atom_y(b.from_atom))
-                dt = math.atan2(y2 - y1, x2 - x1)
-                tmp = abs(dt - 0) % (2 * math.pi)
-                right = min(right, tmp)
-                tmp = min(abs(dt - math.pi), abs(dt + math.pi)) % (2 * math.pi)
-                left = min(left, tmp)
-                tmp = abs(dt - math.pi / 2) % (2 * math.pi)
-                top = min(top, tmp)
-                tmp = abs(dt + math.pi / 2) % (2 * math.pi)
-                bottom = min(bottom, tmp)
-            if right > 1.0:
+            if right[i] > 1.0:
                 atom.spare_space = Molecule.DIRECTION_RIGHT
-            elif left > 1.4:
+            elif left[i] > 1.4:
                 atom.spare_space = Molecule.DIRECTION_LEFT
-            elif bottom > 1.0:
+            elif bottom[i] > 1.0:
                 atom.spare_space = Molecule.DIRECTION_BOTTOM
             else:
                 atom.spare_space = Molecule.DIRECTION_UNSPECIFIED
 
         # 计算分子的平均键长
-        total_length = sum(math.hypot(self.atom_x(b.from_atom) - self.atom_x(b.to),
-                                      self.atom_y(b.from_atom) - self.atom_y(b.to))
-                           for b in self.bonds)
         self.avg_bond_length = total_length / len(self.bonds) if self.bonds else 0.0
+        self.inval_geometry = False
+
+    def get_render_size(self, supersample: float = RENDER_QUALITY["high"][0], layout_scale: float = 1.0):
+        """
+        获取渲染尺寸，需要先确定坐标范围
+
+        :param supersample: 超采样倍数
+        :param layout_scale: 布局缩放比例
+        :return: (width, height, high_res_width, high_res_height)
+        """
+
+        width = int(self.range_x() * 100 * 1.8 * layout_scale)
+        height = int(self.range_y() * 100 * 1.8 * layout_scale)
+        return width, height, int(width * supersample), int(height * supersample)
+
+    def get_layout_scale(self, supersample: float, max_pixels: int = 0,
+                         target_size: Optional[Tuple[int, int]] = None) -> float:
+        """
+        计算使画布不超过 max_pixels、输出图像放入 target_size 的布局缩放比例，需要先确定坐标范围
+        """
+
+        # 按未取整的尺寸计算比例：get_render_size 只会向下取整，缩放后的画布不会超出限制
+        width, height = self.range_x() * 100 * 1.8, self.range_y() * 100 * 1.8
+        layout_scale = 1.0
+        if target_size and width > 0 and height > 0:
+            layout_scale = min(target_size[0] / width, target_size[1] / height)
+        if max_pixels > 0 and width * height * supersample ** 2 * layout_scale ** 2 > max_pixels:
+            layout_scale = math.sqrt(max_pixels / (width * height * supersample ** 2))
+
+        # 浮点误差可能使取整后的尺寸仍略微超出，再次检查并缩小
+        while True:
+            width, height, high_res_width, high_res_height = self.get_render_size(supersample, layout_scale)
+            if target_size and (width > target_size[0] or height > target_size[1]):
+                layout_scale *= 0.999
+            elif 0 < max_pixels < high_res_width * high_res_height:
+                layout_scale *= 0.999
+            else:
+                return layout_scale
 
     def to_mdl_mol_string(self) -> str:
         """
@@ -365,37 +765,59 @@ class Molecule:
         return self.mdl_mol_str
 
     def render_molecule(self, base_elem_padding: int = 50, base_line_width: int = 5, base_font_size: int = 30,
-                        dpi: int = 300, base_grid_size=700, cheating=False):
+                        dpi: int = 300, base_grid_size=700, cheating=False, quality: str = "high",
+                        max_pixels: int = 0, target_size: Optional[Tuple[int, int]] = None,
+                        timings: Optional[Dict[str, float]] = None):
         """
         渲染分子模型
 
+        :param quality: 渲染质量，RENDER_QUALITY 中的 fast、balanced 或 high
+        :param max_pixels: 绘制画布（超采样后）的最大像素数，超出时整体缩小布局，0 表示不限制
+        :param target_size: 输出图像的目标 (宽, 高)，布局按比例缩放至恰好放入该尺寸
         :param cheating: 是否使用作弊模式，即直接高亮手性碳区域
         :param base_grid_size: 基础网格大小
         :param base_font_size: 基础字体大小
         :param base_line_width: 基础线条宽度
         :param base_elem_padding: 基础圆的长宽，用于留白，避免元素符号和线条重合
         :param dpi: 每英寸点数，用于控制输出图像的分辨率
+        :param timings: 不为 None 时向其中累加各阶段耗时（秒）: layout、grid、bonds、atoms、resize
         :return: Image Object
+
+        渲染不修改分子: 防重叠调整作用于本次渲染的坐标副本，绘制状态保存在局部变量中，
+        同一分子可以重复渲染得到相同的图像，也可以在多个线程中同时渲染
         """
 
         logger.info(f"Rendering molecule... cid={self.cid}")
 
-        # 计算坐标
+        last = [time.perf_counter()]
+
+        def lap(stage):
+            if timings is not None:
+                now = time.perf_counter()
+                timings[stage] = timings.get(stage, 0.0) + now - last[0]
+                last[0] = now
+
+        if quality not in RENDER_QUALITY:
+            raise ValueError(f"Unknown render quality: {quality}")
+        supersample, resample = RENDER_QUALITY[quality]
+
+        # 计算坐标与线性碳等几何属性
         self.determine_min_max()
+        self.init_geometry()
 
-        # 原始w, h，用于resize
-        width = int(self.range_x() * 100 * 1.8)
-        height = int(self.range_y() * 100 * 1.8)
+        # 布局缩放比例，字体、线宽与留白由输出尺寸推导，网格与固定偏移量需要额外乘以该比例
+        layout_scale = self.get_layout_scale(supersample, max_pixels, target_size)
+        k = supersample / RENDER_QUALITY["high"][0]  # 像素尺寸相对 high 的缩放比例
+        k_layout = k * layout_scale
 
-        # 提高分辨率, 用于绘制，有利于抗锯齿
-        high_res_width = int(width * 2.5)
-        high_res_height = int(height * 2.5)
+        # 原始w, h，用于resize；提高分辨率, 用于绘制，有利于抗锯齿
+        width, height, high_res_width, high_res_height = self.get_render_size(supersample, layout_scale)
 
         logger.debug(f"base_w, base_h = ({high_res_width}, {high_res_height})")
         logger.debug(f"high_res_w, high_res_h = ({high_res_width}, {high_res_height})")
 
         image = Image.new("RGBA", (high_res_width, high_res_height), (255, 255, 255))
-        self.draw = ImageDraw.Draw(image)
+        draw = ImageDraw.Draw(image)
 
         # 计算缩放比例
         scale_x = high_res_width / self.range_x() if self.range_x() > 0 else 1
@@ -410,45 +832,24 @@ class Molecule:
         font_size = int(base_font_size * (min(width, height) / 500))
 
         logger.debug(f"font_size = {font_size}")
-        base_grid_size = base_grid_size * (1 + font_size / 100)
+        # 网格大小按未缩放的字体大小计算后再整体缩放，保证缩放前后的网格划分一致
+        unscaled_font_size = int(base_font_size * (min(width, height) / layout_scale / 500)) \
+            if layout_scale != 1.0 else font_size
+        base_grid_size = base_grid_size * (1 + unscaled_font_size / 100) * k_layout
 
         # 动态计算线条宽度
-        line_width = int(base_line_width * (min(width, height) / 500))
-
-        elem_padding = int(int(base_elem_padding * (min(width, height) / 1500)) * 0.8)
-
-        # 防止元素符号重叠
-        for i, atom_i in enumerate(self.atoms):
-            for atom_j in self.atoms[i + 1:]:
-                xi = int(atom_i.x * scale + offset_x)
-                yi = int(atom_i.y * scale + offset_y)
-                xj = int(atom_j.x * scale + offset_x)
-                yj = int(atom_j.y * scale + offset_y)
-
-                if abs(xi - xj) < base_elem_padding and abs(yi - yj) < base_elem_padding:
-                    logger.warning(
-                        f"Element symbols are too close: Atom {atom_i.element} at ({atom_i.x}, {atom_i.y}) and Atom {atom_j.element} at ({atom_j.x}, {atom_j.y}). "
-                        f"Adjusting positions..")
-
-                    dx = (base_elem_padding - abs(xi - xj)) // 2
-                    dy = (base_elem_padding - abs(yi - yj)) // 2
-
-                    if xi < xj:
-                        atom_i.x -= dx / scale
-                        atom_j.x += dx / scale
-                    else:
-                        atom_i.x += dx / scale
-                        atom_j.x -= dx / scale
-
-                    if yi < yj:
-                        atom_i.y -= dy / scale
-                        atom_j.y += dy / scale
-                    else:
-                        atom_i.y += dy / scale
-                        atom_j.y -= dy / scale
-
-                    logger.info(
-                        f"Adjusted over: Atom {atom_i.element} at ({atom_i.x}, {atom_i.y}) and Atom {atom_j.element} at ({atom_i.x}, {atom_i.y}). ")
+        line_width = int(base_line_width * (min(width, height) / 500) * k)
+
+        elem_padding = int(int(base_elem_padding * (min(width, height) / 1500)) * 0.8 * k)
+
+        # 氢原子与网格编号的偏移
+        h_offset = int(15 * k_layout)
+        label_offset = 5 * k_layout
+
+        # 防止元素符号重叠，只调整本次渲染的坐标副本
+        xs, ys = array('d', self.xs), array('d', self.ys)
+        self.declutter_atoms(scale, offset_x, offset_y, base_elem_padding * k_layout, xs, ys)
+        lap("layout")
 
         logger.info(f"Drawing grid...")
 
@@ -459,48 +860,35 @@ class Molecule:
             logger.warning("base_grid_size is less than or equal to 0, skipping grid drawing.")
             grid_display_flag = False
 
-        grid_data = {}
-        font = ImageFont.truetype("resource/font/MiSans-Medium.ttf", int(font_size * 1.2))  # 替换为实际字体路径
+        grid = None
+        font = get_font(int(font_size * 1.2 * k))
 
         if grid_display_flag:
-            rows = math.ceil(high_res_height / base_grid_size)
-            cols = math.ceil(high_res_width / base_grid_size)
-
-            for row in range(rows):
-                for col in range(cols):
-                    grid_id = f"{chr(65 + row)}{col + 1}"
-                    x0, y0 = col * base_grid_size, row * base_grid_size
-                    x1, y1 = x0 + base_grid_size, y0 + base_grid_size
-
-                    bg_color = "white"
-                    if (row + col) % 2 == 1:
-                        bg_color = "lightgray"
-                        self.draw.rectangle([x0, y0, x1, y1], fill=bg_color)
-
-                    grid_data[f"{grid_id}.elems"] = []
-                    grid_data[grid_id] = {
-                        "x0": x0,
-                        "y0": y0,
-                        "x1": x1,
-                        "y1": y1,
-                        "bg": bg_color,
-                    }
+            grid = GridIndex(high_res_width, high_res_height, base_grid_size)
+            for row, col in grid.cells():
+                bg_color = grid.cell_bg(row, col)
+                if bg_color != "white":
+                    draw.rectangle(grid.cell_box(row, col), fill=bg_color)
+        lap("grid")
 
         logger.info(f"Drawing bonds...")
 
+        # 原子的屏幕坐标，绘制化学键与元素时共用
+        screen_xs = [int(x * scale + offset_x) for x in xs]
+        screen_ys = [int(y * scale + offset_y) for y in ys]
+
         # 绘制化学键
         for bond in self.bonds:
-            atom1 = self.atoms[bond.from_atom - 1]
-            atom2 = self.atoms[bond.to - 1]
-            self.draw_bond(atom1, atom2, bond.type, scale, offset_x, offset_y, line_width)
+            i, j = bond.from_atom - 1, bond.to - 1
+            self.draw_bond_line(screen_xs[i], screen_ys[i], screen_xs[j], screen_ys[j], bond.type, line_width, draw)
+        lap("bonds")
 
         logger.info(f"Drawing atoms...")
+        chiral_carbons = self.get_chiral_carbons()
         chiral_carbon_regions = []
         # 绘制元素
         atom_index = 1
-        for atom in self.atoms:
-            x = int(atom.x * scale + offset_x)
-            y = int(atom.y * scale + offset_y)
+        for atom, x, y in zip(self.atoms, screen_xs, screen_ys):
             circle_x0 = x - elem_padding
             circle_y0 = y - elem_padding
             circle_x1 = x + elem_padding
@@ -509,7 +897,7 @@ class Molecule:
             # 转换离子符号
             charge_symbol = ""
             if atom.charge != 0:
-                logger.info(f"Found ion with charge {atom.charge} for atom {atom.element} at ({x}, {y}).")
+                logger.info("Found ion with charge %s for atom %s at (%s, %s).", atom.charge, atom.element, x, y)
                 charge_symbol = str(abs(atom.charge))
                 if charge_symbol == "1":
                     charge_symbol = "+" if atom.charge > 0 else "-"
@@ -523,58 +911,56 @@ class Molecule:
             y0 = None
             grid_bg = "white"
             grid_id = None
-            if grid_display_flag:
-                for grid_id, grid in grid_data.items():
-                    try:
-                        if (grid['x0'] <= x < grid['x1']) and (grid['y0'] <= y < grid['y1']):
-                            grid_bg = grid["bg"]
-                            x0 = grid['x0']
-                            y0 = grid['y0']
-                            grid_id = grid_id
-                            break
-                    except TypeError:
-                        pass
+            cell = grid.locate(x, y) if grid_display_flag else None
+            if cell is not None:
+                grid_bg = grid.cell_bg(*cell)
+                x0, y0 = grid.cell_box(*cell)[:2]
+                grid_id = grid.cell_id(*cell)
 
             # 绘制元素符号，并留白
             if (atom.element != "C" or (atom.element == "C" and
                                         not ((atom.show_flag & Molecule.SHOW_FLAG_EXPLICIT) == 0))):
-                logger.info(f"Drawing atom {atom.element} at ({x}, {y})")
+                logger.info("Drawing atom %s at (%s, %s)", atom.element, x, y)
 
                 # 根据网格背景颜色来填充元素符号的留白区域
-                self.draw.ellipse([circle_x0, circle_y0, circle_x1, circle_y1], fill=grid_bg)
-                self.draw.text((x, y), atom.element + charge_symbol, fill="black", font=font, align="center",
-                               anchor="mm")
+                draw.ellipse([circle_x0, circle_y0, circle_x1, circle_y1], fill=grid_bg)
+                draw_text(image, (x, y), atom.element + charge_symbol, fill="black", font=font, anchor="mm")
 
             # 绘制氢原子
             if atom.hydrogen_count > 0:
-                logger.info(f"Drawing hydrogen atoms for {atom.element} at ({x}, {y})")
-                for dx, dy in [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 0), (0, 1), (1, -1), (1, 0), (1, 1)]:
-                    self.draw.text((x + dx, y - 15 + dy), "H", fill=(200, 200, 200, 255), font=font, anchor="mm")
-                self.draw.text((x, y - 15), "H", fill="black", font=font, anchor="mm")
+                logger.info("Drawing hydrogen atoms for %s at (%s, %s)", atom.element, x, y)
+                draw_text(image, (x, y - h_offset), "H", fill="black", font=font, anchor="mm",
+                          stroke_width=1, stroke_fill=(200, 200, 200, 255))
 
             is_chiral_carbon = False
-            if chiral_carbon_helper.is_chiral_carbon(self, atom_index):
-                logger.info(f"chiral carbon -> @{atom_index}")
-                if grid_display_flag:
+            if atom_index in chiral_carbons:
+                logger.info("chiral carbon -> @%s", atom_index)
+                if grid_id:
                     if grid_id not in chiral_carbon_regions:
                         chiral_carbon_regions.append(grid_id)
                     if cheating:
-                        self.draw.text((x0 + 10, y0 + 10), grid_id, fill="red", font=font)
+                        draw_text(image, (x0 + label_offset * 2, y0 + label_offset * 2), grid_id, fill="red",
+                                  font=font)
                 is_chiral_carbon = True
 
             if grid_id:
-                if grid_display_flag:
-                    # 绘制编号
-                    self.draw.text((x0 + 5, y0 + 5), grid_id, fill="black", font=font)
+                # 绘制编号
+                draw_text(image, (x0 + label_offset, y0 + label_offset), grid_id, fill="black", font=font)
 
-                    grid_data[f"{grid_id}.elems"].append(
-                        (x, y, atom.element, atom.hydrogen_count, atom.charge, atom_index, is_chiral_carbon))
+            if grid is not None:
+                grid.add_atom(cell, (x, y, atom.element, atom.hydrogen_count, atom.charge, atom_index,
+                                     is_chiral_carbon))
 
             atom_index += 1
+        lap("atoms")
 
-        image = image.resize((width, height), Image.LANCZOS)
+        if image.size != (width, height):
+            image = image.resize((width, height), resample)
         image.info["dpi"] = (dpi, dpi)
+        lap("resize")
+
+        grid_data = grid.to_dict() if grid is not None else {}
 
         logger.info(f"Render completely! cid={self.cid}")
-        logger.info(f"grid_data -> {grid_data}")
+        logger.info("grid_data -> %s", grid_data)
         return image, grid_data, chiral_carbon_regions
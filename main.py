@@ -1,9 +1,11 @@
-import json
+import queue
 import random
+import threading
+import time
 import tkinter as tk
 from PIL import Image, ImageTk
 import os
-from util import mdl_mol_parser, chiral_carbon_helper, logger
+from util import logger, corpus_index, challenge, mol_pack
 from config import *
 
 
@@ -28,50 +30,100 @@ class ChiralCaptchaApp:
         self.mol_load_path = mol_load_path
         self.files = files
         self.molecule = molecule
+        self.pack = None  # 预解析分子库
         self.chiral_carbon_regions = []
+        self.prefetch_queue = None  # 后台预生成的题目
+        self.refresh_pending = False  # 是否正在等待预生成的题目
         self.logger = logger.Logger(log_level, "ChiralGrid-log.txt")
         self.init_once()
 
     def init_once(self):
         self.logger.info("Initializing...")
-        self.files = self.load_molecule(self.mol_res_path)
+        self.pack = mol_pack.open_pack(mol_pack_path, self.mol_res_path)
+        self.files = self.load_molecule_index(mol_index_path)
+        if self.files is None:
+            self.files = self.pack.files if self.pack is not None else self.load_molecule(self.mol_res_path)
         if not self.files:
             raise InitializedError(f"No molecules found in the directory: '{self.mol_res_path}'")
 
+    def load_molecule_index(self, index_path, min_chiral=min_chiral_count, max_chiral=max_chiral_count,
+                            max_atoms=max_atom_count):
+        """
+        从分子库索引中加载符合难度要求的分子文件，索引不可用时返回 None
+        """
+
+        if not index_path or not os.path.isfile(index_path):
+            return None
+        try:
+            entries = corpus_index.load_index(index_path)
+        except (ValueError, KeyError, OSError) as e:
+            self.logger.error(f"Ignoring molecule index {index_path}: {e}")
+            return None
+
+        eligible = corpus_index.filter_index(entries, max(1, min_chiral), max_chiral, max_atoms)
+        self.logger.info(f"Loaded {len(eligible)}/{len(entries)} eligible molecules from index: {index_path}")
+        return [e["file"] for e in eligible]
+
     def load_molecule(self, directory):
         self.logger.info(f"Loading molecules from directory: {directory}")
         return [f for f in os.listdir(directory) if os.path.isfile(os.path.join(directory, f)) and f.endswith('.mol')]
 
-    def random_molecule(self):
+    def pick_molecule(self):
+        """
+        随机选择并解析一个分子，不修改实例状态，可在后台线程中调用
+        :return: (mol_load_path, molecule)
+        """
+
         if not self.files:
             raise InitializedError("Molecule files have not been initialized or the directory is empty.")
-        self.mol_load_path = f"{self.mol_res_path}/{random.choice(self.files)}"
-        self.logger.info(f"Loading molecule from: {self.mol_load_path}")
-        string_mol = open(self.mol_load_path, "r", encoding="utf-8").read()
-        return mdl_mol_parser.parse_string(string_mol)
+        path = f"{self.mol_res_path}/{random.choice(self.files)}"
+        self.logger.info(f"Loading molecule from: {path}")
+        return path, challenge.get_molecule(path, self.pack)
 
-    def refresh_image(self):
-        self.molecule = self.random_molecule()
-        result = self.molecule.render_molecule(base_elem_padding=base_elem_padding,
-                                               base_line_width=base_line_width,
-                                               base_font_size=base_font_size,
-                                               dpi=dpi, base_grid_size=base_grid_size,
-                                               cheating=cheating)
-        image = result[0]
-        cid = self.molecule.cid
-
-        self.chiral_carbon_regions = result[2]
+    def random_molecule(self):
+        self.mol_load_path, molecule = self.pick_molecule()
+        return molecule
+
+    def create_challenge(self):
+        """
+        生成一道含有手性碳的题目，不修改实例状态，可在后台线程中调用
+        图像直接在内存中返回，是否保存到 result/ 由 config.save_image 与 config.save_grid 控制，并在后台完成
+        渲染结果按 config.render_cache_* 缓存，重复抽到的分子直接读取缓存
+        :return: (mol_load_path, molecule, image, chiral_carbon_regions)
+        """
+
+        path, molecule = self.pick_molecule()
+        while not molecule.get_chiral_carbons():
+            self.logger.error("No chiral carbon for you! refresh again..")
+            path, molecule = self.pick_molecule()
 
-        image.save(f"result/{cid}_molecule.png")
+        image, grid_data, regions, png = challenge.render_challenge_cached(molecule)
+        challenge.save_challenge_async(molecule.cid, image, grid_data, png=png)
+        return path, molecule, image, regions
 
-        with open(f"result/data/{cid}_grid_data.json", 'w', encoding='utf-8') as json_file:
-            json.dump(result[1], json_file, ensure_ascii=False, indent=4, sort_keys=True)
+    def refresh_image(self):
+        self.mol_load_path, self.molecule, image, self.chiral_carbon_regions = self.create_challenge()
+        return image
 
-        if not chiral_carbon_helper.get_molecule_chiral_carbons(self.molecule):
-            self.logger.error("No chiral carbon for you! refresh again..")
-            self.refresh_image()
+    def start_prefetch(self, depth=prefetch_depth):
+        """
+        启动后台线程预生成题目，depth 为 0 时不预生成
+        """
 
-        return f"result/{cid}_molecule.png"
+        if depth <= 0 or self.prefetch_queue is not None:
+            return
+        self.prefetch_queue = queue.Queue(depth)
+        threading.Thread(target=self.prefetch_worker, name="ChallengePrefetch", daemon=True).start()
+
+    def prefetch_worker(self):
+        while True:
+            try:
+                item = self.create_challenge()
+            except Exception as e:
+                self.logger.error(f"Error in prefetch_worker: {e}")
+                time.sleep(1)
+                continue
+            self.prefetch_queue.put(item)  # 队列满时阻塞
 
     def resize_image(self, event):
         if event is not None:
@@ -101,9 +153,37 @@ class ChiralCaptchaApp:
         self.canvas.config(scrollregion=(0, 0, new_img_width, new_img_height))
 
     def refresh_tk(self):
-        path = self.refresh_image()
+        if self.prefetch_queue is None:
+            self.show_challenge(None)
+            return
+
+        # 从预生成队列中取题，尚未生成完成时通过 root.after 轮询，避免阻塞界面
+        try:
+            item = self.prefetch_queue.get_nowait()
+        except queue.Empty:
+            if not self.refresh_pending:
+                self.refresh_pending = True
+                self.callback_label.config(text="正在生成题目...")
+            self.root.after(100, self.refresh_tk)
+            return
+
+        if self.refresh_pending:
+            self.refresh_pending = False
+            self.callback_label.config(text="")
+        self.show_challenge(item)
+
+    def show_challenge(self, item):
+        """
+        在界面中显示题目
+
+        :param item: 预生成的 (mol_load_path, molecule, image, chiral_carbon_regions)，为 None 时同步生成
+        """
+
+        if item is None:
+            img = self.refresh_image()
+        else:
+            self.mol_load_path, self.molecule, img, self.chiral_carbon_regions = item
 
-        img = Image.open(path)
         self.img_var[0] = img
         self.img_tk = ImageTk.PhotoImage(img)
         self.label.config(image=self.img_tk)
@@ -117,10 +197,10 @@ class ChiralCaptchaApp:
 
     def submit_answer(self):
         try:
-            answer = str(self.entry.get()).split(",")
+            answer = str(self.entry.get())
             self.logger.info(f"User submitted: {answer}")
             self.entry.delete(0, tk.END)
-            if sorted(answer) == sorted(self.chiral_carbon_regions):
+            if challenge.check_answer(answer, self.chiral_carbon_regions):
                 self.callback_label.config(text=f"回答正确")
             else:
                 self.callback_label.config(text=f"回答错误")
@@ -135,10 +215,7 @@ class ChiralCaptchaApp:
         width, height = self.root.maxsize()
         self.root.geometry(f"{int(width * 0.8)}x{int(height * 0.8)}")
 
-        path = self.refresh_image()
-
-        # 加载图像
-        img = Image.open(path)
+        img = self.refresh_image()
 
         self.img_var = [img]
         self.img_tk = ImageTk.PhotoImage(img)
@@ -177,7 +254,7 @@ class ChiralCaptchaApp:
 
         # 刷新按钮
         refresh_button = tk.Button(self.root, text="看不清，换一题",
-                                   command=lambda: self.refresh_tk())
+                                   command=lambda: self.refresh_pending or self.refresh_tk())
         refresh_button.pack(side=tk.TOP, fill=tk.X, pady=5)
 
         # 提交按钮
@@ -199,6 +276,9 @@ class ChiralCaptchaApp:
         # 绑定回车键
         self.entry.bind("<Return>", lambda event: submit_button.invoke())
 
+        # 在后台预生成后续题目
+        self.start_prefetch()
+
         self.root.mainloop()
 
 
@@ -0,0 +1,125 @@
+import argparse
+import os
+import random
+import sys
+import time
+from multiprocessing import Pool
+from typing import List, Optional
+
+import config
+from util import logger, challenge, corpus_index
+
+"""
+无界面批量生成题目
+使用进程池并行渲染，每道题保存图像以及网格数据与答案:
+
+python -m util.batch_generator --count 100000 --workers 8 --output bank
+"""
+
+logger = logger.Logger(config.log_level, "ChiralGrid-log.txt")
+
+# 平均每道题最多抽取的分子数
+MAX_DRAWS_PER_CHALLENGE = 100
+
+
+def generate_one(task):
+    """
+    生成单道题目，在工作进程中执行
+
+    :param task: (序号, 分子文件路径, 输出目录, 渲染参数)
+    :return: (序号, cid, 答案)，分子不含手性碳或生成失败时答案为 None
+    """
+
+    seq, path, out_dir, params = task
+    try:
+        molecule = challenge.get_molecule(path)
+        if not molecule.get_chiral_carbons():
+            return seq, molecule.cid, None
+        image, grid_data, regions, png = challenge.render_challenge_cached(molecule, params, encode=True)
+        challenge.save_challenge(f"{seq:06d}_{molecule.cid}", image, grid_data, out_dir, answer=regions, png=png)
+        return seq, molecule.cid, regions
+    except Exception as e:
+        logger.error(f"Failed to generate challenge #{seq} from {path}: {e}")
+        return seq, None, None
+
+
+def choose_files(mol_dir: str, count: int, index_path: Optional[str] = None) -> List[str]:
+    """
+    随机选择 count 个分子文件（可重复），索引存在时只从符合难度要求的分子中选择
+    """
+
+    if index_path and os.path.isfile(index_path):
+        entries = corpus_index.filter_index(corpus_index.load_index(index_path), max(1, config.min_chiral_count),
+                                            config.max_chiral_count, config.max_atom_count)
+        files = [e["file"] for e in entries]
+    else:
+        files = [f for f in os.listdir(mol_dir) if f.endswith(".mol")]
+    if not files:
+        raise ValueError(f"No molecules available in '{mol_dir}'")
+    return [os.path.join(mol_dir, f) for f in random.choices(files, k=count)]
+
+
+def generate(count: int, out_dir: str = "bank", mol_dir: str = "resource/mol", index_path: Optional[str] = None,
+             workers: Optional[int] = None, chunksize: int = 8, progress_every: int = 100, stream=sys.stderr):
+    """
+    使用进程池批量生成题目，分子不含手性碳或生成失败时继续抽取，直到生成 count 道题
+
+    :param count: 题目数量
+    :param out_dir: 输出目录
+    :param workers: 进程数，默认使用全部 CPU
+    :param chunksize: 每个任务块包含的题目数
+    :param progress_every: 每完成多少道题输出一次进度
+    :return: (成功数, 跳过数, 耗时)
+    """
+
+    os.makedirs(os.path.join(out_dir, "data"), exist_ok=True)
+    # 题库图像用于作答，无论 config.cheating 如何都不能高亮答案
+    params = dict(challenge.render_params(), cheating=False)
+
+    done = skipped = seq = 0
+    start = time.time()
+    with Pool(workers) as pool:
+        while done < count:
+            # 每轮按缺少的题目数抽取分子，序号接续上一轮，避免覆盖已生成的题目
+            paths = choose_files(mol_dir, count - done, index_path)
+            tasks = [(seq + i, path, out_dir, params) for i, path in enumerate(paths)]
+            seq += len(tasks)
+            failed = 0
+            for _, cid, regions in pool.imap_unordered(generate_one, tasks, chunksize):
+                if regions is None:
+                    skipped += 1
+                    failed += cid is None
+                    continue
+                done += 1
+                if done % progress_every == 0 or done == count:
+                    elapsed = time.time() - start
+                    print(f"[{done}/{count}] skipped={skipped} "
+                          f"{done / elapsed if elapsed > 0 else 0.0:.2f} challenges/sec", file=stream, flush=True)
+            # 整轮都生成失败（如输出目录不可写），或分子库中几乎没有含手性碳的分子时，继续抽取也无济于事
+            if failed == len(tasks) or seq >= count * MAX_DRAWS_PER_CHALLENGE:
+                logger.error(f"Giving up at {done}/{count} challenges after drawing {seq} molecules")
+                break
+        # 正常结束工作进程（而不是由 with 语句终止），使其在退出前写完磁盘缓存与日志
+        pool.close()
+        pool.join()
+
+    elapsed = time.time() - start
+    print(f"Generated {done} challenges ({skipped} skipped) in {elapsed:.2f}s, "
+          f"{done / elapsed if elapsed > 0 else 0.0:.2f} challenges/sec", file=stream, flush=True)
+    return done, skipped, elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate ChiralGrid challenges without the GUI")
+    parser.add_argument("--count", type=int, default=100, help="number of challenges")
+    parser.add_argument("--output", default="bank", help="output directory")
+    parser.add_argument("--mol-dir", default="resource/mol", help="directory of .mol files")
+    parser.add_argument("--index", default=config.mol_index_path, help="molecule index built by util.corpus_index")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all CPUs)")
+    parser.add_argument("--chunksize", type=int, default=8, help="challenges per worker task")
+    parser.add_argument("--progress-every", type=int, default=100, help="report progress every N challenges")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for molecule selection")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    generate(args.count, args.output, args.mol_dir, args.index, args.workers, args.chunksize, args.progress_every)
@@ -0,0 +1,175 @@
+import json
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Optional
+
+from PIL import ImageChops
+
+import config
+from entity import Molecule
+from util import logger, render_cache
+from util.render_cache import encode_png
+from util.challenge_token import normalize_answer
+from util.mdl_mol_parser import MdlMolParser
+
+"""
+题目生成：解析分子、渲染并保存图像与网格数据，不依赖 tkinter
+"""
+
+logger = logger.Logger(config.log_level, "ChiralGrid-log.txt")
+
+
+def render_params() -> dict:
+    """
+    从 config 读取渲染参数
+    """
+
+    return dict(base_elem_padding=config.base_elem_padding,
+                base_line_width=config.base_line_width,
+                base_font_size=config.base_font_size,
+                dpi=config.dpi,
+                base_grid_size=config.base_grid_size,
+                cheating=config.cheating,
+                quality=config.render_quality,
+                max_pixels=config.max_pixels,
+                target_size=(config.target_width, config.target_height)
+                if config.target_width > 0 and config.target_height > 0 else None)
+
+
+def load_molecule_file(path: str) -> Molecule:
+    """
+    读取并解析分子文件
+    """
+
+    return MdlMolParser.parse_file(path)
+
+
+@lru_cache(maxsize=config.molecule_cache_size)
+def get_molecule(path: str, pack=None) -> Molecule:
+    """
+    获取已解析并初始化的分子，进程内按 (路径, 预解析分子库) 缓存最近使用的 config.molecule_cache_size 个分子
+    渲染不会修改分子，返回的分子可以在多次渲染、多个线程间共享
+
+    :param pack: 预解析分子库 MolPack，包含该文件时直接从中读取
+    """
+
+    name = os.path.basename(path)
+    if pack is not None and name in pack:
+        return pack.load_file(name)
+    return load_molecule_file(path)
+
+
+def render_challenge(molecule: Molecule, params: dict = None):
+    """
+    渲染分子
+
+    :param params: 渲染参数，默认使用 render_params()
+    :return: (image, grid_data, chiral_carbon_regions)
+    """
+
+    return molecule.render_molecule(**(params if params is not None else render_params()))
+
+
+def check_answer(answer: str, regions) -> bool:
+    """
+    检查以逗号分隔的答案（如 "A1,B2"）是否与手性碳所在的区域一致，忽略顺序、空白与大小写
+    """
+
+    return normalize_answer(answer) == normalize_answer(regions)
+
+
+def has_answer_highlight(image) -> bool:
+    """
+    检查图像中是否有作弊模式绘制的红色网格编号，即答案是否被高亮
+    """
+
+    r, g, b = image.convert("RGB").split()
+    red = ImageChops.multiply(ImageChops.multiply(r.point(lambda v: 255 if v > 180 else 0),
+                                                  g.point(lambda v: 255 if v < 80 else 0)),
+                              b.point(lambda v: 255 if v < 80 else 0))
+    return red.getbbox() is not None
+
+
+def render_challenge_cached(molecule: Molecule, params: dict = None, cache=None, encode: bool = False):
+    """
+    渲染分子，结果按分子内容与渲染参数缓存，命中内存缓存时直接返回图像，命中磁盘缓存时解码缓存的 PNG
+    返回的图像可能与缓存共享，不能修改
+
+    :param cache: RenderCache，默认使用 render_cache.get_cache()，为 None 时（缓存关闭）直接渲染
+    :param encode: 调用方是否需要 PNG，为 True 时在本线程中编码（同时交给缓存，不再重复编码），
+                   否则 PNG 只在写磁盘缓存、保存图像时于后台编码
+    :return: (image, grid_data, chiral_carbon_regions, png)，png 为编码后的图像，未编码时为 None
+    """
+
+    params = params if params is not None else render_params()
+    cache = cache if cache is not None else render_cache.get_cache()
+    key = render_cache.cache_key(molecule, params) if cache is not None else None
+    entry = cache.get(key) if cache is not None else None
+    if entry is not None:
+        image, png, grid_data, regions = entry
+        if png is None and encode:
+            png = encode_png(image)
+        return image, grid_data, regions, png
+
+    image, grid_data, regions = molecule.render_molecule(**params)
+    png = encode_png(image) if encode else None
+    if cache is not None:
+        cache.put(key, image, grid_data, regions, png)
+    return image, grid_data, regions, png
+
+
+def save_challenge(name, image, grid_data, out_dir: str = "result", answer=None,
+                   save_image: bool = True, save_grid: bool = True, png: Optional[bytes] = None):
+    """
+    保存图像到 {out_dir}/{name}_molecule.png，网格数据到 {out_dir}/data/{name}_grid_data.json
+
+    :param answer: 不为 None 时与网格数据一起保存
+    :param save_image: 是否保存图像
+    :param save_grid: 是否保存网格数据
+    :param png: 已编码的 PNG 图像，给定时直接写入而不再编码 image
+    :return: 图像路径
+    """
+
+    image_path = os.path.join(out_dir, f"{name}_molecule.png")
+    if save_image:
+        os.makedirs(out_dir, exist_ok=True)
+        if png is not None:
+            with open(image_path, "wb") as f:
+                f.write(png)
+        else:
+            image.save(image_path)
+
+    if save_grid:
+        os.makedirs(os.path.join(out_dir, "data"), exist_ok=True)
+        data = grid_data if answer is None else {"answer": answer, "grid_data": grid_data}
+        with open(os.path.join(out_dir, "data", f"{name}_grid_data.json"), 'w', encoding='utf-8') as json_file:
+            json.dump(data, json_file, ensure_ascii=False, indent=4, sort_keys=True)
+    return image_path
+
+
+_save_executor = None
+
+
+def save_challenge_async(name, image, grid_data, out_dir: str = "result", answer=None,
+                         png: Optional[bytes] = None) -> Optional[Future]:
+    """
+    按 config.save_image 与 config.save_grid 在后台线程中保存题目，两者都关闭时不做任何事
+
+    :return: 保存任务的 Future，未保存时返回 None
+    """
+
+    global _save_executor
+    if not config.save_image and not config.save_grid:
+        return None
+    if _save_executor is None:
+        _save_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ChallengeSaver")
+    future = _save_executor.submit(save_challenge, name, image, grid_data, out_dir, answer,
+                                   config.save_image, config.save_grid, png)
+
+    def on_done(f):
+        if f.exception() is not None:
+            logger.error(f"Failed to save challenge {name}: {f.exception()}")
+
+    future.add_done_callback(on_done)
+    return future
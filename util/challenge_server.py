@@ -0,0 +1,364 @@
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import secrets
+import signal
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+import config
+from util import logger, challenge, challenge_token, corpus_index, mol_pack
+
+"""
+本地题目服务
+基于 asyncio 的 HTTP 服务，渲染在进程池中完成，不会阻塞事件循环:
+
+python -m util.challenge_server --port 8080 --workers 8
+
+GET  /challenge                  -> {"id", "token", "image"(base64 PNG), "expires_in"}
+GET  /challenge?format=png       -> PNG 图像，题目 id、令牌与有效期在 X-Challenge-Id、X-Challenge-Token、
+                                    X-Challenge-Expires-In 头中
+POST /verify {"id", "answer"}    -> {"ok"}，每道题只能验证一次
+POST /verify {"token", "answer"} -> {"ok"}，无状态验证，使用同一 challenge_secret 的任意节点都可以验证
+"""
+
+logger = logger.Logger(config.log_level, "ChiralGrid-log.txt")
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 64 * 1024
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+           500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class TTLStore:
+    """
+    带有效期的题目存储，超过有效期或超出容量时淘汰最早加入的题目
+    所有题目的有效期相同，加入顺序即过期顺序
+    """
+
+    def __init__(self, ttl: float, max_size: int = 0):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.items: OrderedDict = OrderedDict()  # id -> (过期时间, 值)
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, key, value):
+        self.items[key] = (time.monotonic() + self.ttl, value)
+        self.items.move_to_end(key)
+        while 0 < self.max_size < len(self.items):
+            self.items.popitem(last=False)
+
+    def pop(self, key):
+        """
+        取出并删除题目，不存在或已过期时返回 None
+        """
+
+        item = self.items.pop(key, None)
+        if item is None or item[0] < time.monotonic():
+            return None
+        return item[1]
+
+    def evict_expired(self) -> int:
+        now = time.monotonic()
+        count = 0
+        while self.items:
+            key, (expires, _) = next(iter(self.items.items()))
+            if expires >= now:
+                break
+            del self.items[key]
+            count += 1
+        return count
+
+
+# ------------------- 工作进程 -------------------
+_files = []
+_pack = None
+_params = None
+
+
+def init_worker(files, pack_path: Optional[str], params: dict):
+    global _files, _pack, _params
+    _files = files
+    _pack = mol_pack.open_pack(pack_path)
+    _params = params
+
+
+def make_challenge():
+    """
+    随机生成一道含有手性碳的题目，在工作进程中执行
+
+    :return: (cid, PNG 图像, 答案)
+    """
+
+    while True:
+        path = random.choice(_files)
+        molecule = challenge.get_molecule(path, _pack)
+        if molecule.get_chiral_carbons():
+            break
+    _, _, regions, png = challenge.render_challenge_cached(molecule, _params, encode=True)
+    return molecule.cid, png, regions
+
+
+def list_molecule_files(mol_dir: str, index_path: Optional[str], pack: Optional[mol_pack.MolPack]):
+    """
+    可抽题的分子文件路径：优先使用索引按难度筛选，其次使用预解析分子库的文件列表，最后扫描目录
+    """
+
+    if index_path and os.path.isfile(index_path):
+        entries = corpus_index.filter_index(corpus_index.load_index(index_path), max(1, config.min_chiral_count),
+                                            config.max_chiral_count, config.max_atom_count)
+        names = [e["file"] for e in entries]
+    elif pack is not None:
+        names = pack.files
+    else:
+        names = [f for f in os.listdir(mol_dir) if f.endswith(".mol")]
+    if not names:
+        raise ValueError(f"No molecules available in '{mol_dir}'")
+    return [os.path.join(mol_dir, f) for f in names]
+
+
+# ------------------- HTTP 服务 -------------------
+class ChallengeServer:
+
+    def __init__(self, mol_dir: str = "resource/mol", workers: Optional[int] = None, ttl: float = 300,
+                 store_size: int = 100000, prefetch: int = 8, secret: str = "", read_timeout: float = 10):
+        """
+        :param workers: 渲染进程数，默认使用全部 CPU
+        :param ttl: 题目有效期（秒）
+        :param store_size: 最多保存的未验证题目数
+        :param prefetch: 预先渲染备用的题目数，0 表示收到请求时才渲染
+        :param secret: 题目令牌的签名密钥，为空时随机生成（令牌只能由本进程验证）
+        :param read_timeout: 读取请求头、请求体各自的超时时间（秒），超时后关闭连接，0 表示不限制
+        """
+
+        pack = mol_pack.open_pack(config.mol_pack_path, mol_dir)
+        files = list_molecule_files(mol_dir, config.mol_index_path, pack)
+        # 预解析文件已过期时工作进程也不使用
+        pack_path = config.mol_pack_path if pack is not None else None
+        if pack is not None:
+            pack.close()
+
+        # 题目图像发给用户作答，无论 config.cheating 如何都不能高亮答案
+        self.params = dict(challenge.render_params(), cheating=False)
+        self.store = TTLStore(ttl, store_size)
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(self.workers, initializer=init_worker,
+                                            initargs=(files, pack_path, self.params))
+        self.prefetch = prefetch
+        if not secret:
+            logger.warning("challenge_secret is not set, tokens can only be verified by this process")
+        self.secret = secret or secrets.token_bytes(32)
+        self.read_timeout = read_timeout if read_timeout > 0 else None
+        self.ready: Optional[asyncio.Queue] = None
+        self.tasks = []
+        self.server = None
+
+    async def render(self):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, make_challenge)
+
+    async def prefetch_worker(self):
+        while True:
+            try:
+                item = await self.render()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Failed to render challenge: {e}")
+                await asyncio.sleep(1)
+                continue
+            await self.ready.put(item)
+
+    async def evict_worker(self):
+        while True:
+            await asyncio.sleep(max(1.0, min(60.0, self.store.ttl / 10)))
+            evicted = self.store.evict_expired()
+            if evicted:
+                logger.debug("Evicted %s expired challenges, %s pending", evicted, len(self.store))
+
+    async def next_challenge(self):
+        if self.ready is not None:
+            return await self.ready.get()
+        return await self.render()
+
+    async def new_challenge(self):
+        cid, png, regions = await self.next_challenge()
+        challenge_id = secrets.token_urlsafe(16)
+        self.store.put(challenge_id, regions)
+        token = challenge_token.issue_token(self.secret, regions, self.store.ttl)
+        logger.info("Issued challenge %s (cid=%s)", challenge_id, cid)
+        return challenge_id, token, png
+
+    async def handle_get_challenge(self, query):
+        challenge_id, token, png = await self.new_challenge()
+        expires_in = str(int(self.store.ttl))
+        if query.get("format", [""])[0] == "png":
+            return 200, png, "image/png", {"X-Challenge-Id": challenge_id, "X-Challenge-Token": token,
+                                           "X-Challenge-Expires-In": expires_in}
+        return json_response(200, {"id": challenge_id, "token": token,
+                                   "image": base64.b64encode(png).decode("ascii"), "expires_in": int(self.store.ttl)})
+
+    async def handle_verify(self, body: bytes):
+        try:
+            data = json.loads(body.decode("utf-8"))
+            answer = str(data["answer"])
+            token = data.get("token")
+            challenge_id = str(data["id"]) if token is None else None
+        except (ValueError, KeyError, TypeError, AttributeError, UnicodeDecodeError):
+            return json_response(400, {"ok": False, "error": 'expected JSON {"id" or "token": ..., "answer": "A1,B2"}'})
+
+        if token is not None:
+            ok = challenge_token.verify_token(self.secret, str(token), answer)
+            logger.info("Verified challenge token: %s", ok)
+            return json_response(200, {"ok": ok})
+
+        regions = self.store.pop(challenge_id)
+        if regions is None:
+            return json_response(404, {"ok": False, "error": "unknown or expired challenge"})
+        ok = challenge.check_answer(answer, regions)
+        logger.info("Verified challenge %s: %s", challenge_id, ok)
+        return json_response(200, {"ok": ok})
+
+    async def dispatch(self, method: str, target: str, body: bytes):
+        url = urlsplit(target)
+        if url.path == "/challenge":
+            if method != "GET":
+                return json_response(405, {"error": "use GET"})
+            return await self.handle_get_challenge(parse_qs(url.query))
+        if url.path == "/verify":
+            if method != "POST":
+                return json_response(405, {"error": "use POST"})
+            return await self.handle_verify(body)
+        return json_response(404, {"error": f"no route for {url.path}"})
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    # 整个请求头（而不是每次读取）限时，逐字节慢速发送的连接也会超时
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.read_timeout)
+                except (asyncio.IncompleteReadError, ConnectionError, asyncio.TimeoutError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await write_response(writer, *json_response(413, {"error": "headers too large"}), keep_alive=False)
+                    break
+
+                lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = lines[0].split(" ", 2)
+                except ValueError:
+                    await write_response(writer, *json_response(400, {"error": "bad request line"}), keep_alive=False)
+                    break
+                headers = {}
+                for line in lines[1:]:
+                    name, sep, value = line.partition(":")
+                    if sep:
+                        headers[name.strip().lower()] = value.strip()
+
+                try:
+                    length = int(headers.get("content-length", "0") or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await write_response(writer, *json_response(400, {"error": "invalid Content-Length"}),
+                                         keep_alive=False)
+                    break
+                if length > MAX_BODY_BYTES:
+                    await write_response(writer, *json_response(413, {"error": "body too large"}), keep_alive=False)
+                    break
+                body = await asyncio.wait_for(reader.readexactly(length), self.read_timeout) if length > 0 else b""
+
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                try:
+                    response = await self.dispatch(method, target, body)
+                except Exception as e:
+                    logger.error(f"Error handling {method} {target}: {e}")
+                    response = json_response(500, {"error": "internal error"})
+                await write_response(writer, *response, keep_alive=keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str, port: int):
+        if self.prefetch > 0:
+            # 每个渲染进程对应一个预渲染任务，渲染好的题目最多缓存 prefetch 道
+            self.ready = asyncio.Queue(self.prefetch)
+            self.tasks += [asyncio.create_task(self.prefetch_worker()) for _ in range(self.workers)]
+        self.tasks.append(asyncio.create_task(self.evict_worker()))
+        self.server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_HEADER_BYTES)
+        logger.info("Challenge server listening on http://%s:%s", host, port)
+
+    async def serve_forever(self, host: str, port: int):
+        """
+        启动服务直到收到 SIGINT / SIGTERM，退出前关闭渲染进程
+        """
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass  # Windows 不支持，Ctrl+C 时由 KeyboardInterrupt 退出
+        await self.start(host, port)
+        try:
+            await stop.wait()
+        finally:
+            await self.close()
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        if self.server is not None:
+            self.server.close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def json_response(status: int, data):
+    return status, json.dumps(data).encode("utf-8"), "application/json", {}
+
+
+async def write_response(writer: asyncio.StreamWriter, status: int, body: bytes, content_type: str,
+                         headers: dict, keep_alive: bool = True):
+    head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {len(body)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    head += [f"{name}: {value}" for name, value in headers.items()]
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+    await writer.drain()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve ChiralGrid challenges over HTTP")
+    parser.add_argument("--host", default=config.server_host, help="listen address")
+    parser.add_argument("--port", type=int, default=config.server_port, help="listen port")
+    parser.add_argument("--mol-dir", default="resource/mol", help="directory of .mol files")
+    parser.add_argument("--workers", type=int, default=None, help="render processes (default: all CPUs)")
+    parser.add_argument("--ttl", type=float, default=config.challenge_ttl, help="challenge lifetime in seconds")
+    parser.add_argument("--store-size", type=int, default=config.challenge_store_size,
+                        help="maximum number of pending challenges")
+    parser.add_argument("--prefetch", type=int, default=config.server_prefetch,
+                        help="challenges rendered ahead of requests")
+    parser.add_argument("--read-timeout", type=float, default=config.server_read_timeout,
+                        help="seconds allowed to receive the request headers and the body (0 for no limit)")
+    args = parser.parse_args()
+
+    server = ChallengeServer(args.mol_dir, args.workers, args.ttl, args.store_size, args.prefetch,
+                             config.challenge_secret, args.read_timeout)
+    try:
+        asyncio.run(server.serve_forever(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,119 @@
+import base64
+import hashlib
+import hmac
+import json
+import secrets
+import time
+from typing import Iterable, Optional, Union
+
+"""
+无状态题目令牌
+令牌中只包含有效期、随机 nonce 以及正确答案的带密钥摘要，并用 HMAC-SHA256 签名。
+持有同一密钥的任意节点都可以直接验证答案，无需共享题目存储:
+
+token = issue_token(key, regions, ttl=300)
+verify_token(key, token, " b2, a1 ")  # True
+
+令牌内容对客户端可读，因此不包含 cid、渲染参数等能定位分子的信息（分子库是公开的，知道分子即可算出答案）；
+答案摘要同样使用密钥计算（并加入随机 nonce），无法据此穷举出答案。
+令牌本身不记录是否已被使用，有效期内可以重复提交，需要一次性验证时应在外部记录已使用的 nonce。
+"""
+
+VERSION = 2
+
+
+class InvalidTokenError(ValueError):
+    pass
+
+
+def normalize_answer(answer: Union[str, Iterable[str]]) -> str:
+    """
+    将答案规范化为排序后的区域列表，忽略顺序、空白、大小写与重复项
+
+    :param answer: 以逗号分隔的字符串（如 "B2, a1"）或区域列表
+    :return: 如 "A1,B2"
+    """
+
+    parts = answer.split(",") if isinstance(answer, str) else answer
+    return ",".join(sorted({"".join(p.split()).upper() for p in parts} - {""}))
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _key_bytes(key: Union[str, bytes]) -> bytes:
+    return key.encode("utf-8") if isinstance(key, str) else key
+
+
+def _answer_digest(key: bytes, nonce: str, answer: Union[str, Iterable[str]]) -> str:
+    message = b"answer\0" + nonce.encode("ascii") + b"\0" + normalize_answer(answer).encode("utf-8")
+    return _b64encode(hmac.new(key, message, hashlib.sha256).digest())
+
+
+def _sign(key: bytes, payload: str) -> str:
+    return _b64encode(hmac.new(key, b"token\0" + payload.encode("ascii"), hashlib.sha256).digest())
+
+
+def issue_token(key: Union[str, bytes], regions: Iterable[str], ttl: float = 300,
+                now: Optional[float] = None) -> str:
+    """
+    签发题目令牌
+
+    :param key: 签名密钥，所有验证节点共享
+    :param regions: 手性碳所在的区域
+    :param ttl: 有效期（秒）
+    """
+
+    key = _key_bytes(key)
+    nonce = secrets.token_urlsafe(12)
+    claims = {"v": VERSION,
+              "exp": int((time.time() if now is None else now) + ttl),
+              "nonce": nonce,
+              "answer": _answer_digest(key, nonce, regions)}
+    payload = _b64encode(json.dumps(claims, separators=(",", ":"), sort_keys=True).encode("utf-8"))
+    return f"{payload}.{_sign(key, payload)}"
+
+
+def decode_token(key: Union[str, bytes], token: str, now: Optional[float] = None) -> dict:
+    """
+    校验签名与有效期并返回令牌内容
+
+    :raise InvalidTokenError: 令牌格式错误、签名不符或已过期
+    """
+
+    key = _key_bytes(key)
+    token = str(token)
+    if not token.isascii():
+        raise InvalidTokenError("Malformed token")
+    payload, sep, signature = token.partition(".")
+    if not sep or not hmac.compare_digest(_sign(key, payload), signature):
+        raise InvalidTokenError("Bad token signature")
+    try:
+        claims = json.loads(_b64decode(payload))
+        version = claims.get("v")
+        expired = claims["exp"] < (time.time() if now is None else now)
+    except (ValueError, KeyError, TypeError, AttributeError):
+        raise InvalidTokenError("Malformed token payload")
+    if version != VERSION:
+        raise InvalidTokenError(f"Unsupported token version: {version}")
+    if expired:
+        raise InvalidTokenError("Token has expired")
+    return claims
+
+
+def verify_token(key: Union[str, bytes], token: str, answer: Union[str, Iterable[str]],
+                 now: Optional[float] = None) -> bool:
+    """
+    验证答案，令牌无效或过期时返回 False
+    """
+
+    try:
+        claims = decode_token(key, token, now)
+    except InvalidTokenError:
+        return False
+    return hmac.compare_digest(_answer_digest(_key_bytes(key), claims["nonce"], answer), claims["answer"])
@@ -1,8 +1,30 @@
+import random
+import threading
+from typing import List, Optional
+
+import config
 from entity import Molecule, Bond
 from util.index_from import index_from
 
+# 手性碳检测引擎
+MODE_RECURSIVE = "recursive"  # 逐原子递归比较取代基链
+MODE_SYMMETRY = "symmetry"  # 整分子一次性计算对称类
+
+
+def get_molecule_chiral_carbons(mol: Molecule, mode: str = None) -> set:
+    """
+    获取分子中所有手性碳的索引
+
+    :param mode: 检测引擎，MODE_RECURSIVE 或 MODE_SYMMETRY，默认使用 config.chiral_mode
+    """
+
+    if mode is None:
+        mode = config.chiral_mode
+    if mode == MODE_SYMMETRY:
+        return get_molecule_chiral_carbons_by_symmetry(mol)
+    if mode != MODE_RECURSIVE:
+        raise ValueError(f"Unknown chiral mode: {mode}")
 
-def get_molecule_chiral_carbons(mol: Molecule) -> set:
     ret = set()
     for i in range(1, mol.atom_count() + 1):
         if is_chiral_carbon(mol, i):
@@ -10,33 +32,231 @@ def get_molecule_chiral_carbons(mol: Molecule) -> set:
     return ret
 
 
+@index_from(1)
+def get_atom_classes(mol: Molecule) -> List[int]:
+    """
+    以类似 Morgan 算法的方式迭代细分原子的不变量，得到整分子的对称类
+    末端氢原子折算进相邻原子的氢原子数，不参与细分
+
+    :return: 每个原子的对称类编号，末端氢原子为 0
+    """
+
+    adjacency, hcnt, _ = _heavy_atom_graph(mol)
+    return _refine_classes(mol, adjacency, hcnt)
+
+
+def _heavy_atom_graph(mol: Molecule):
+    """
+    构建只包含重原子的邻接表 (键类型, 相邻原子下标)，末端氢原子（仅一个键的 H）折算为相邻原子的氢原子数
+    不使用分子的邻接索引，省去为每个原子建立索引的开销；先假定所有氢原子都是末端氢原子，只遍历一次化学键，
+    存在连有多个键或没有键的氢原子时再按度数重新构建
+
+    :return: (adjacency, hcnt, multiple)，末端氢原子的邻接表为 None，multiple[i] 表示原子是否连有非单键
+    """
+
+    # 解析时已保证键的两端是不同的有效原子
+    atoms = mol.atoms
+    adjacency = [None if a.element == "H" else [] for a in atoms]
+    hcnt = [a.hydrogen_count for a in atoms]
+    multiple = [False] * len(atoms)
+    hydrogens = []  # 每个键上的氢原子
+    for b in mol.bonds:
+        i, j, t = b.from_atom - 1, b.to - 1, b.type
+        if t > 1:
+            multiple[i] = multiple[j] = True
+        env = adjacency[i]
+        if env is None:
+            hydrogens.append(i)
+            if adjacency[j] is None:
+                hydrogens.append(j)
+            else:
+                hcnt[j] += 1
+        elif adjacency[j] is None:
+            hydrogens.append(j)
+            hcnt[i] += 1
+        else:
+            env.append((t, j))
+            adjacency[j].append((t, i))
+    # 每个氢原子恰好出现一次，即都是末端氢原子
+    if len(hydrogens) == adjacency.count(None) == len(set(hydrogens)):
+        return adjacency, hcnt, multiple
+    return _heavy_atom_graph_by_degree(mol)
+
+
+def _heavy_atom_graph_by_degree(mol: Molecule):
+    """
+    _heavy_atom_graph 的通用版本，先统计每个原子的度数再确定末端氢原子
+    """
+
+    atoms = mol.atoms
+    edges = [(b.from_atom - 1, b.to - 1, b.type) for b in mol.bonds]
+    degree = [0] * len(atoms)
+    multiple = [False] * len(atoms)
+    for i, j, t in edges:
+        degree[i] += 1
+        degree[j] += 1
+        if t > 1:
+            multiple[i] = multiple[j] = True
+
+    heavy = [not (a.element == "H" and d == 1) for a, d in zip(atoms, degree)]
+    adjacency = [[] if is_heavy else None for is_heavy in heavy]
+    hcnt = [a.hydrogen_count for a in atoms]
+    for i, j, t in edges:
+        if heavy[i] and heavy[j]:
+            adjacency[i].append((t, j))
+            adjacency[j].append((t, i))
+        elif heavy[i]:
+            hcnt[i] += 1
+        elif heavy[j]:
+            hcnt[j] += 1
+    return adjacency, hcnt, multiple
+
+
+# (类别, 键类型) 编码为 类别 * 4 + 键类型（键类型不超过 3），每个编码对应一个固定的 64 位随机数，
+# 邻居多重集的哈希为这些随机数之和，不同多重集的和相同的概率可以忽略
+_weights: List[int] = []
+_weights_lock = threading.Lock()
+_weights_rng = random.Random(0x43484952)
+
+
+def _get_weights(count: int) -> List[int]:
+    """
+    :return: 至少包含 count 个编码的随机数表
+    """
+
+    if len(_weights) < count:
+        with _weights_lock:
+            while len(_weights) < count:
+                _weights.append(_weights_rng.getrandbits(64))
+    return _weights
+
+
+def _refine_classes(mol: Molecule, adjacency, hcnt, groups: Optional[List[List[int]]] = None) -> List[int]:
+    """
+    迭代细分对称类，直到类别不再拆分，结果与按 (类别, 排序后的邻居类别) 逐轮细分全部原子相同
+
+    每个原子的签名为相邻原子 (类别, 键类型) 哈希值之和（多重集哈希，无需排序），相邻原子换类时增量更新；
+    每轮只重新划分含有签名变化的原子的类别，拆分时最大的部分保留原编号，其余部分换新编号，
+    因此每轮的工作量只与换类原子的邻居数成正比，而不是全部原子
+    细分只会拆分类别，因此当 groups 中每组原子都已两两属于不同类别时可以提前结束
+
+    :param groups: 需要区分的原子下标组（从 0 开始），为 None 时计算完整的对称类
+    """
+
+    # 初始类别：按不变量首次出现的顺序编号，末端氢原子为 0；编号只用于区分类别，不具有跨分子的规范性
+    table = {None: 0}
+    classes = [table.setdefault((a.element, a.charge, a.isotope, h, len(env)) if env is not None else None, len(table))
+               for a, h, env in zip(mol.atoms, hcnt, adjacency)]
+    if groups is not None and _resolved(classes, groups):
+        return classes
+    members = [[] for _ in table]  # 类别 -> 原子下标，类别 0 为末端氢原子
+    for i, c in enumerate(classes):
+        members[c].append(i)
+
+    # 类别数不超过原子数，编码不超过 (原子数 + 1) * 4
+    weights = _get_weights((len(classes) + 1) * 4)
+    signatures = [sum([weights[classes[j] * 4 + t] for t, j in env]) if env is not None else 0
+                  for env in adjacency]
+    pending = [c for c in range(1, len(members)) if len(members[c]) > 1]
+    while pending:
+        # 先按本轮开始时的签名拆分所有待检查的类别，再统一更新签名，与逐轮同步细分一致
+        moved = []  # (原子, 原类别)
+        for c in pending:
+            m = members[c]
+            if len(m) == 2:  # 最常见的情况，无需分组
+                i, j = m
+                if signatures[i] != signatures[j]:
+                    members[c] = [i]
+                    classes[j] = len(members)
+                    members.append([j])
+                    moved.append((j, c))
+                continue
+            parts = {}
+            for i in m:
+                parts.setdefault(signatures[i], []).append(i)
+            if len(parts) == 1:
+                continue
+            parts = sorted(parts.values(), key=len, reverse=True)
+            members[c] = parts[0]
+            for part in parts[1:]:
+                new = len(members)
+                members.append(part)
+                for i in part:
+                    moved.append((i, c))
+                    classes[i] = new
+
+        if not moved:
+            break
+        touched = set()
+        for j, old in moved:
+            new, old = classes[j] * 4, old * 4
+            for t, i in adjacency[j]:
+                signatures[i] += weights[new + t] - weights[old + t]
+                touched.add(classes[i])
+        pending = [c for c in touched if len(members[c]) > 1]
+        if groups is not None and _resolved(classes, groups):
+            break
+    return classes
+
+
+def _resolved(classes: List[int], groups: List[List[int]]) -> bool:
+    """
+    groups 中是否每组原子都已两两属于不同类别，同时从 groups 中移除已经区分开的组
+    """
+
+    groups[:] = [g for g in groups if len({classes[k] for k in g}) != len(g)]
+    return not groups
+
+
+def get_molecule_chiral_carbons_by_symmetry(mol: Molecule) -> set:
+    """
+    基于对称类判断手性碳：取代基对应的相邻原子两两属于不同的对称类即为手性碳
+    """
+
+    adjacency, hcnt, multiple = _heavy_atom_graph(mol)
+
+    # 候选原子：只含单键，且有 4 个非氢取代基或 3 个非氢取代基加 1 个氢原子的碳
+    atoms = mol.atoms
+    candidates = []
+    for i, atom in enumerate(atoms):
+        env = adjacency[i]
+        if atom.element != "C" or env is None or multiple[i]:
+            continue
+        if (len(env) == 4 and hcnt[i] == 0) or (len(env) == 3 and hcnt[i] == 1):
+            # 不变量相同的两个末端取代基（如两个甲基、CF3 中的氟）无论细分多少轮都属于同一类，不必参与细分
+            leaves = [(atoms[j].element, atoms[j].charge, atoms[j].isotope, hcnt[j]) for _, j in env
+                      if len(adjacency[j]) == 1]
+            if len(set(leaves)) == len(leaves):
+                candidates.append((i, [j for _, j in env]))
+    if not candidates:
+        return set()
+
+    classes = _refine_classes(mol, adjacency, hcnt, [g for _, g in candidates])
+    return {i + 1 for i, g in candidates if len(set(classes[j] for j in g)) == len(g)}
+
+
 @index_from(1)
 def is_chiral_carbon(mol, index):
     atom = mol.get_atom(index)
     if atom.element != "C":
         return False
 
-    bonds = mol.get_atom_declared_bonds(index)
-    for b in bonds:
-        if b.type > 1:  # 不是单键
+    bond_ids = mol.get_atom_declared_bond_ids(index)
+    for n in bond_ids:
+        if mol.get_bond(n).type > 1:  # 不是单键
             return False
 
     hcnt = atom.hydrogen_count
     bondnh = []
 
-    for b in bonds:
-        if b.from_atom == index:
-            another = b.to
-        else:
-            another = b.from_atom
-
-        if mol.get_atom(another).element == "H" and len(mol.get_atom_declared_bonds(another)) == 1:
+    for n, another in zip(bond_ids, mol.get_atom_neighbors(index)):
+        if mol.get_atom(another).element == "H" and mol.get_atom_degree(another) == 1:
             hcnt += 1
             continue
-        bondnh.append(b)
+        bondnh.append(n)
 
     if len(bondnh) == 4 and hcnt == 0:
-        b1, b2, b3, b4 = [mol.get_bond_id(b) for b in bondnh]
+        b1, b2, b3, b4 = bondnh
         return not (compare_chain(mol, index, b1, b2) or
                     compare_chain(mol, index, b1, b3) or
                     compare_chain(mol, index, b1, b4) or
@@ -44,7 +264,7 @@ def is_chiral_carbon(mol, index):
                     compare_chain(mol, index, b2, b4) or
                     compare_chain(mol, index, b3, b4))
     elif len(bondnh) == 3 and hcnt == 1:
-        b1, b2, b3 = [mol.get_bond_id(b) for b in bondnh]
+        b1, b2, b3 = bondnh
         return not (compare_chain(mol, index, b1, b2) or
                     compare_chain(mol, index, b1, b3) or
                     compare_chain(mol, index, b2, b3))
@@ -54,10 +274,121 @@ def is_chiral_carbon(mol, index):
 
 @index_from(1)
 def compare_chain(mol, center, chain1, chain2):
-    return compare_chain_recursive(mol, center, center, chain1, chain2,
+    return compare_chain_iterative(mol, center, center, chain1, chain2,
                                    3 + int(mol.atom_count() ** 0.5))
 
 
+@index_from(1)
+def compare_chain_iterative(mol: Molecule, atom1: int, atom2: int, chain1: int, chain2: int, ttl: int) -> bool:
+    """
+    compare_chain_recursive 的等价实现，结果与其完全一致
+    使用显式栈代替递归，并按 (atom1, atom2, chain1, chain2, ttl) 在分子上缓存比较结果
+    """
+
+    memo = mol.chiral_cache.setdefault("compare_chain", {})
+    root = (atom1, atom2, chain1, chain2, ttl)
+    if root in memo:
+        return memo[root]
+
+    frame = _open_chain_frame(mol, memo, root)
+    if not isinstance(frame, list):
+        return frame
+
+    # 栈帧: [key, another1, another2, bondnh1, bondnh2, ttl, i, j]
+    # 对 bondnh1 中的每条链 i，在 bondnh2 中寻找第一条可匹配的链 j
+    stack = [frame]
+    while stack:
+        frame = stack[-1]
+        key, another1, another2, bondnh1, bondnh2, child_ttl, i, j = frame
+        result = None
+        while result is None:
+            if i == len(bondnh1):
+                result = True
+                break
+            if j == len(bondnh2):
+                result = False
+                break
+            child_key = (another1, another2, bondnh1[i], bondnh2[j], child_ttl)
+            matched = memo.get(child_key)
+            if matched is None:
+                matched = _open_chain_frame(mol, memo, child_key)
+                if isinstance(matched, list):
+                    break
+            if matched:
+                i, j = i + 1, 0
+            else:
+                j += 1
+
+        frame[6], frame[7] = i, j
+        if result is None:
+            stack.append(matched)
+        else:
+            memo[key] = result
+            stack.pop()
+
+    return memo[root]
+
+
+def _open_chain_frame(mol: Molecule, memo: dict, key: tuple):
+    """
+    执行 compare_chain_recursive 中递归之前的部分
+    能直接得出结果时写入缓存并返回 bool，否则返回待展开的栈帧
+    """
+
+    atom1, atom2, chain1, chain2, ttl = key
+    b1 = mol.get_bond(chain1)
+    b2 = mol.get_bond(chain2)
+    if b1.type != b2.type:
+        memo[key] = False
+        return False
+
+    another1 = b1.to if b1.from_atom == atom1 else b1.from_atom
+    another2 = b2.to if b2.from_atom == atom2 else b2.from_atom
+    if mol.get_atom(another1).element != mol.get_atom(another2).element:
+        memo[key] = False
+        return False
+
+    # 原实现按 (键列表, 原子) 的相等关系决定第二侧排除的原子，并按键列表是否相等决定结果写入哪一侧:
+    # 两侧键列表相同时结果都写入第一侧，第二侧保持原子自身的氢原子数与空链表
+    second = _chain_branches(mol, another2, atom1 if another1 == another2 else atom2)
+    if mol.get_atom_declared_bond_ids(another1) == mol.get_atom_declared_bond_ids(another2):
+        hcnt1, bondnh1 = second
+        hcnt2, bondnh2 = mol.get_atom(another2).hydrogen_count, []
+    else:
+        hcnt1, bondnh1 = _chain_branches(mol, another1, atom1)
+        hcnt2, bondnh2 = second
+
+    if hcnt1 != hcnt2 or len(bondnh1) != len(bondnh2) or ttl < 0:
+        memo[key] = False
+        return False
+    if not bondnh1:
+        memo[key] = True
+        return True
+    return [key, another1, another2, bondnh1, bondnh2, ttl - 1, 0, 0]
+
+
+def _chain_branches(mol: Molecule, atom: int, avoid: int):
+    """
+    统计原子除 avoid 方向之外的末端氢原子数与非氢键
+    :return: (hcnt, bondnh)
+    """
+
+    cache = mol.chiral_cache.setdefault("chain_branches", {})
+    ret = cache.get((atom, avoid))
+    if ret is None:
+        hcnt = 0
+        bondnh = []
+        for b, other in zip(mol.get_atom_declared_bond_ids(atom), mol.get_atom_neighbors(atom)):
+            if other == avoid:
+                continue
+            if mol.get_atom(other).element == "H" and mol.get_atom_degree(other) == 1:
+                hcnt += 1
+            else:
+                bondnh.append(b)
+        ret = cache[(atom, avoid)] = (hcnt, bondnh)
+    return ret
+
+
 @index_from(1)
 def compare_chain_recursive(mol: Molecule, atom1: int, atom2: int, chain1: Bond, chain2: Bond, ttl: int):
     b1 = mol.get_bond(chain1)
@@ -89,7 +420,7 @@ def compare_chain_recursive(mol: Molecule, atom1: int, atom2: int, chain1: Bond,
             if other_atom_index == atoms_to_avoid[bonds_pairs.index((bonds, another))]:
                 continue
             atom = mol.get_atom(other_atom_index)
-            if atom.element == "H" and len(mol.get_atom_declared_bonds(other_atom_index)) == 1:
+            if atom.element == "H" and mol.get_atom_degree(other_atom_index) == 1:
                 hcnt += 1
             else:
                 bondnh.append(b)
@@ -0,0 +1,110 @@
+import argparse
+import json
+import os
+import time
+from multiprocessing import Pool
+from typing import List, Optional
+
+import config
+from util import logger
+from util.mdl_mol_parser import MdlMolParser
+
+"""
+分子库索引
+离线解析 resource/mol 下的所有分子，记录原子数、手性碳数与坐标范围，
+使程序可以直接从符合条件的分子中抽题，而无需先渲染再检查是否含有手性碳
+"""
+
+INDEX_VERSION = 1
+
+logger = logger.Logger(config.log_level, "ChiralGrid-log.txt")
+
+
+def index_file(path: str) -> Optional[dict]:
+    """
+    解析单个分子文件并生成索引项，解析失败时返回 None
+    """
+
+    try:
+        molecule = MdlMolParser.parse_file(path)
+        molecule.determine_min_max()
+        return {
+            "file": os.path.basename(path),
+            "cid": molecule.cid,
+            "atoms": molecule.atom_count(),
+            "chiral": len(molecule.get_chiral_carbons()),
+            "bbox": [molecule.min_x, molecule.min_y, molecule.max_x, molecule.max_y],
+        }
+    except Exception as e:
+        logger.error(f"Failed to index {path}: {e}")
+        return None
+
+
+def build_index(directory: str, index_path: str, processes: Optional[int] = None, chunksize: int = 32) -> List[dict]:
+    """
+    使用进程池并行构建分子库索引并写入 index_path
+
+    :param directory: 分子文件目录
+    :param index_path: 索引文件路径
+    :param processes: 进程数，默认使用全部 CPU
+    :param chunksize: 每个任务块包含的文件数
+    :return: 索引项列表
+    """
+
+    files = sorted(f for f in os.listdir(directory) if f.endswith(".mol"))
+    paths = [os.path.join(directory, f) for f in files]
+    logger.info(f"Indexing {len(paths)} molecules from {directory}...")
+
+    start = time.time()
+    with Pool(processes) as pool:
+        entries = [e for e in pool.imap(index_file, paths, chunksize) if e is not None]
+
+    with open(index_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "version": INDEX_VERSION,
+            "chiral_mode": config.chiral_mode,
+            "molecules": entries,
+        }, f, ensure_ascii=False)
+
+    logger.info(f"Indexed {len(entries)}/{len(paths)} molecules in {time.time() - start:.2f}s -> {index_path}")
+    return entries
+
+
+def load_index(index_path: str) -> List[dict]:
+    """
+    读取分子库索引，版本或手性碳检测引擎不一致时抛出 ValueError
+    """
+
+    with open(index_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("version") != INDEX_VERSION:
+        raise ValueError(f"Unsupported index version: {data.get('version')}")
+    if data.get("chiral_mode") != config.chiral_mode:
+        raise ValueError(f"Index was built with chiral_mode={data.get('chiral_mode')}, "
+                         f"current chiral_mode={config.chiral_mode}")
+    return data["molecules"]
+
+
+def filter_index(entries: List[dict], min_chiral: int = 1, max_chiral: int = 0, max_atoms: int = 0) -> List[dict]:
+    """
+    按难度筛选索引项
+
+    :param min_chiral: 最少手性碳数
+    :param max_chiral: 最多手性碳数，0 表示不限制
+    :param max_atoms: 最多原子数，0 表示不限制
+    """
+
+    return [e for e in entries
+            if e["chiral"] >= min_chiral
+            and (max_chiral <= 0 or e["chiral"] <= max_chiral)
+            and (max_atoms <= 0 or e["atoms"] <= max_atoms)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build the ChiralGrid molecule index")
+    parser.add_argument("--mol-dir", default="resource/mol", help="directory of .mol files")
+    parser.add_argument("--output", default=config.mol_index_path, help="index file path")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes (default: all CPUs)")
+    parser.add_argument("--chunksize", type=int, default=32, help="files per worker task")
+    args = parser.parse_args()
+    build_index(args.mol_dir, args.output, args.processes, args.chunksize)
@@ -0,0 +1,58 @@
+import math
+from functools import lru_cache
+
+from PIL import Image, ImageDraw, ImageFont
+
+"""
+字体与字形缓存
+字体文件按字号只加载一次；元素符号、离子符号、网格编号等文字按 (字体, 文本, 锚点, 亚像素起点, 描边宽度)
+只用 ImageDraw.text 光栅化一次，之后通过 Image.paste 以缓存的灰度蒙版把颜色贴到图像上
+"""
+
+FONT_PATH = "resource/font/MiSans-Medium.ttf"
+
+
+@lru_cache(maxsize=32)
+def get_font(size: int, path: str = FONT_PATH) -> ImageFont.FreeTypeFont:
+    """
+    获取指定字号的字体，进程内按 (字号, 路径) 缓存
+    """
+
+    return ImageFont.truetype(path, size)
+
+
+@lru_cache(maxsize=4096)
+def get_glyph(font: ImageFont.FreeTypeFont, text: str, anchor, start: tuple, stroke_width: int = 0):
+    """
+    光栅化文本
+
+    :param start: 文本起点的小数部分，使缓存的蒙版与直接在该坐标绘制的结果一致
+    :param stroke_width: 描边宽度，不为 0 时蒙版为描边后的轮廓
+    :return: (mask, offset)，mask 为 "L" 模式的图像，贴在起点整数部分加 offset 处
+    """
+
+    left, top, right, bottom = font.getbbox(text, anchor=anchor, stroke_width=stroke_width)
+    # 四周各留 1 像素，容纳亚像素起点带来的偏移
+    left, top = left - 1, top - 1
+    mask = Image.new("L", (right - left + 1, bottom - top + 1), 0)
+    ImageDraw.Draw(mask).text((start[0] - left, start[1] - top), text, fill=255, font=font, anchor=anchor,
+                              stroke_width=stroke_width, stroke_fill=255)
+    return mask, (left, top)
+
+
+def draw_text(image: Image.Image, xy, text: str, fill, font: ImageFont.FreeTypeFont, anchor=None,
+              stroke_width: int = 0, stroke_fill=None):
+    """
+    使用缓存的字形绘制单行文本，fill 与 stroke_fill 为不透明颜色时等价于
+    ImageDraw.Draw(image).text(xy, text, fill=fill, font=font, anchor=anchor,
+                               stroke_width=stroke_width, stroke_fill=stroke_fill)
+    """
+
+    start = (math.modf(xy[0])[0], math.modf(xy[1])[0])
+    x, y = int(xy[0]), int(xy[1])
+    if stroke_width:
+        # 先以描边颜色贴描边轮廓，再以文字颜色贴文字本身
+        mask, (dx, dy) = get_glyph(font, text, anchor, start, stroke_width)
+        image.paste(fill if stroke_fill is None else stroke_fill, (x + dx, y + dy), mask)
+    mask, (dx, dy) = get_glyph(font, text, anchor, start)
+    image.paste(fill, (x + dx, y + dy), mask)
@@ -1,47 +1,230 @@
-import time
+import atexit
+import multiprocessing.util
+import os
+import queue
 import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows，不加进程间锁
+    fcntl = None
 
 LEVEL_DEBUG = 1
 LEVEL_INFO = 2
 LEVEL_WARNING = 3
 LEVEL_ERROR = 4
 
+# 日志文件轮转：超过 max_bytes 后重命名为 .1 ~ .backup_count
+# 多个进程（如进程池中的工作进程）写同一文件时，任一进程都可以轮转，轮转在锁文件 {log_file}.lock 的保护下进行；
+# 其他进程发现文件被轮转后重新打开
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 3
+
+# 队列容量，写入线程跟不上时调用方会阻塞等待，避免内存无限增长
+DEFAULT_QUEUE_SIZE = 10000
+
+# 每批最多写入的记录数，每批写完后 flush 一次
+BATCH_SIZE = 256
+
+
+def get_time(t=None):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time() if t is None else t))
+
+
+def format_message(message, args):
+    """
+    延迟格式化日志消息：message 可以是 %-格式字符串（配合 args）或返回字符串的可调用对象
+    """
+
+    if callable(message):
+        message = message()
+    if args:
+        message = message % args
+    return message
+
+
+class LogWriter:
+    """
+    后台写日志线程，同一进程内写同一文件的 Logger 共享一个实例
+    """
+
+    def __init__(self, log_file=None, max_bytes=DEFAULT_MAX_BYTES, backup_count=DEFAULT_BACKUP_COUNT,
+                 queue_size=DEFAULT_QUEUE_SIZE):
+        self.log_file = log_file
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.pid = os.getpid()
+        self.queue = queue.Queue(queue_size)
+        self.file = None
+        self.thread = threading.Thread(target=self.run, name=f"LogWriter({log_file})", daemon=True)
+        self.thread.start()
+
+    def put(self, record):
+        self.queue.put(record)
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = False
+            lines = []
+            for record in batch:
+                if record is None:
+                    stop = True
+                    continue
+                t, level, message = record
+                lines.append(f"[{get_time(t)}] [{level}] : {message}")
+
+            if lines:
+                text = "\n".join(lines)
+                print(text)
+                self.write_to_log_file(text + "\n")
+
+            for _ in batch:
+                self.queue.task_done()
+            if stop:
+                self.close_file()
+                return
+
+    def write_to_log_file(self, text):
+        if self.log_file is None:
+            return
 
-def get_time():
-    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))
+        try:
+            if self.file is not None and not self.is_current_file():
+                self.close_file()  # 已被其他进程轮转，改写新文件
+            if self.file is None:
+                self.file = open(self.log_file, 'a', encoding='utf-8')
+            self.file.write(text)
+            self.file.flush()
+            if 0 < self.max_bytes <= self.file.tell():
+                self.rotate()
+        except OSError as e:
+            print(f"[{get_time()}] [E] : Failed to write log file {self.log_file}: {e}")
+            self.close_file()
+
+    def is_current_file(self) -> bool:
+        """
+        打开的文件是否仍是 log_file（未被重命名或删除）
+        """
+
+        try:
+            st = os.stat(self.log_file)
+        except FileNotFoundError:
+            return False
+        fst = os.fstat(self.file.fileno())
+        return (st.st_dev, st.st_ino) == (fst.st_dev, fst.st_ino)
+
+    def rotate(self):
+        """
+        取得锁后重新检查文件：多个进程同时写满时，只有第一个取得锁的进程重命名，
+        其余进程发现文件已被轮转（不再是打开的文件，或大小未超出 max_bytes）后直接改写新文件，
+        不会把刚轮转出的备份再挤掉一次
+        """
+
+        with open(f"{self.log_file}.lock", "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)  # 关闭文件时释放
+            rotated = not self.is_current_file() or os.stat(self.log_file).st_size < self.max_bytes
+            self.close_file()
+            if not rotated:
+                self.rename_files()
+
+    def rename_files(self):
+        if self.backup_count <= 0:
+            os.remove(self.log_file)
+            return
+        for n in range(self.backup_count - 1, 0, -1):
+            src = f"{self.log_file}.{n}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.log_file}.{n + 1}")
+        os.replace(self.log_file, f"{self.log_file}.1")
+
+    def close_file(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def close(self):
+        """
+        写完队列中剩余的日志后结束写入线程
+        """
+
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(log_file=None) -> LogWriter:
+    """
+    获取写入指定文件的 LogWriter
+    fork 出的子进程中没有父进程的写入线程，此时会重新创建；进程池的工作进程退出时不执行 atexit，
+    因此同时注册 multiprocessing 的终结器，在其正常退出时（排在渲染缓存等其他终结器之后）写完队列中剩余的日志
+    """
+
+    with _writers_lock:
+        writer = _writers.get(log_file)
+        if writer is None or writer.pid != os.getpid():
+            writer = _writers[log_file] = LogWriter(log_file)
+            multiprocessing.util.Finalize(writer, writer.close, exitpriority=0)
+        return writer
+
+
+@atexit.register
+def close_all():
+    with _writers_lock:
+        writers = [w for w in _writers.values() if w.pid == os.getpid()]
+    for writer in writers:
+        writer.close()
 
 
 class Logger:
+    """
+    日志记录器
+
+    消息可以使用 %-格式参数或可调用对象，只有在日志等级满足时才会格式化:
+    logger.debug("grid_data -> %s", grid_data)
+    logger.debug(lambda: f"grid_data -> {grid_data}")
+    格式化在调用线程中完成（参数之后可能被修改），后台线程只负责写入
+    """
+
     def __init__(self, level: int = LEVEL_INFO, log_file=None):
         self.log_file = log_file
         self.level = level
-        self.lock = threading.Lock()
 
-    def output(self, level, message):
-        _time = get_time()
-        with self.lock:
-            self.write_to_log_file(_time, level, message)
-            print(f"[{_time}] [{level}] : {message}")
+    def output(self, level, message, args=()):
+        t = time.time()
+        try:
+            message = format_message(message, args)
+        except Exception as e:
+            message = f"<log format error: {e!r}> {message!r} % {args!r}"
+        get_writer(self.log_file).put((t, level, message))
 
-    def info(self, message):
+    def info(self, message, *args):
         if self.level <= LEVEL_INFO:
-            threading.Thread(target=self.output, args=("I", message)).start()
+            self.output("I", message, args)
 
-    def error(self, message):
+    def error(self, message, *args):
         if self.level <= LEVEL_ERROR:
-            threading.Thread(target=self.output, args=("E", message)).start()
+            self.output("E", message, args)
 
-    def debug(self, message):
+    def debug(self, message, *args):
         if self.level <= LEVEL_DEBUG:
-            threading.Thread(target=self.output, args=("D", message)).start()
+            self.output("D", message, args)
 
-    def warning(self, message):
+    def warning(self, message, *args):
         if self.level <= LEVEL_WARNING:
-            threading.Thread(target=self.output, args=("W", message)).start()
-
-    def write_to_log_file(self, _time, level, message):
-        if self.log_file is None:
-            return
+            self.output("W", message, args)
 
-        with open(self.log_file, 'a') as f:
-            f.write(f"[{_time}] [{level}] : {message}\n")
+    def is_enabled(self, level: int) -> bool:
+        return self.level <= level
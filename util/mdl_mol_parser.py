@@ -1,3 +1,6 @@
+import mmap
+from array import array
+
 from entity import Atom, Bond
 from entity import Molecule
 
@@ -12,6 +15,23 @@ class BadMolFormatException(Exception):
         super().__init__(msg)
 
 
+# 原子行电荷字段 -> (净电荷, 未配对电子数)
+_ATOM_CHARGE = {1: (3, 0), 2: (2, 0), 3: (1, 0), 4: (0, 2), 5: (-1, 0), 6: (-2, 0), 7: (-3, 0)}
+
+# M 块属性行 -> 类型编号，同 parse_string
+_M_BLOCK_TYPES = {b"M  CHG": 1, b"M  RAD": 2, b"M  ISO": 3, b"M  RGP": 4, b"M  HYD": 5, b"M  ZCH": 6, b"M  ZBO": 7}
+
+# 元素符号缓存，同一元素的原子共享一个字符串
+_elements = {}
+
+
+def _element(raw: bytes) -> str:
+    element = _elements.get(raw)
+    if element is None:
+        element = _elements[raw] = raw.strip().decode("utf-8")
+    return element
+
+
 class MdlMolParser:
     @staticmethod
     def parse_string(str_input) -> Molecule:
@@ -147,3 +167,117 @@ class MdlMolParser:
         molecule.init_once()
         return molecule
 
+    @staticmethod
+    def parse_file(path: str, use_mmap: bool = False) -> Molecule:
+        """
+        以二进制方式读取并解析mol文件，读取后即关闭文件
+
+        :param use_mmap: 是否通过 mmap 读取，适合较大的文件
+        """
+
+        with open(path, "rb") as f:
+            if use_mmap:
+                try:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        data = mm[:]
+                except ValueError:  # 空文件无法映射
+                    data = b""
+            else:
+                data = f.read()
+        return MdlMolParser.parse_bytes(data)
+
+    @staticmethod
+    def parse_bytes(data: bytes, encoding: str = "utf-8", init: bool = True) -> Molecule:
+        """
+        将mol字节串解析为Molecule对象，结果与 parse_string(data.decode(encoding)) 相同
+
+        直接按固定列宽切片字节串并交给 int/float 转换，不逐字段 strip 和解码，也不构造未使用的字段
+
+        :param init: 是否调用 init_once，为 False 时由调用方自行初始化（如分别计时解析与初始化）
+        """
+
+        lines = data.splitlines()
+        start = -1
+        for i, line in enumerate(lines):
+            if len(line) >= 39 and line.startswith(b"V2000", 34):
+                start = i
+                break
+        if start == -1:
+            raise BadMolFormatException("V2000 tag not found at any_line.substring(34, 39)")
+
+        cid = int(lines[0]) if lines[0].isdigit() else 0
+        num_atoms = int(lines[start][:3])
+        num_bonds = int(lines[start][3:6])
+        if start + 1 + num_atoms + num_bonds > len(lines):
+            raise BadMolFormatException("Invalid MDL MOL: truncated atom or bond block")
+
+        atoms = []
+        xs, ys, zs = array('d'), array('d'), array('d')
+        no_charge = (0, 0)
+        for n, line in enumerate(lines[start + 1:start + 1 + num_atoms], start=start + 2):
+            if len(line) < 39:
+                raise BadMolFormatException(f"Invalid MDL MOL: atom line{n}")
+            xs.append(float(line[:10]))
+            ys.append(float(line[10:20]))
+            zs.append(float(line[20:30]))
+            chg, rad = _ATOM_CHARGE.get(int(line[36:39]), no_charge)
+            atoms.append(Atom(chg, _element(line[31:34]), 0, 0, 0, 0,
+                              int(line[60:63]) if len(line) >= 63 else 0, rad))
+
+        bonds = []
+        for n, line in enumerate(lines[start + 1 + num_atoms:start + 1 + num_atoms + num_bonds],
+                                 start=start + num_atoms + 2):
+            if len(line) < 12:
+                raise BadMolFormatException(f"Invalid MDL MOL: bond line{n}")
+            from_atom = int(line[:3])
+            to = int(line[3:6])
+            if from_atom == to or from_atom < 1 or from_atom > num_atoms or to < 1 or to > num_atoms:
+                raise BadMolFormatException(f"Invalid MDL MOL: bond line{n}")
+            order = int(line[6:9])
+            stereo = int(line[9:12])
+            bonds.append(Bond(from_atom, to, order if 1 <= order <= 3 else 1,
+                              1 if stereo == 1 else 2 if stereo == 6 else 0))
+
+        molecule = Molecule(cid, atoms, bonds, data.decode(encoding), (xs, ys, zs))
+        for i in range(start + num_atoms + num_bonds + 1, len(lines)):
+            line = lines[i]
+            if line.startswith(b"M  END"):
+                break
+
+            type2 = _M_BLOCK_TYPES.get(line[:6], 0)
+            if type2 == 0:
+                # 原子别名: "A  nnn" 的下一行为元素符号
+                if line.startswith(b"A  ") and len(line) >= 6 and i + 1 < len(lines):
+                    anum = int(line[3:6])
+                    if 1 <= anum <= num_atoms:
+                        molecule.get_atom(anum).element = lines[i + 1].decode(encoding)
+                continue
+
+            try:
+                len_values = int(line[6:9])
+                for n3 in range(len_values):
+                    pos = int(line[(n3 * 8) + 9:(n3 * 8) + 13])
+                    val = int(line[(n3 * 8) + 13:(n3 * 8) + 17])
+                    if pos < 1:
+                        raise BadMolFormatException("Invalid MDL MOL: M-block")
+
+                    if type2 == 1:
+                        molecule.get_atom(pos).charge = val
+                    elif type2 == 2:
+                        molecule.get_atom(pos).unpaired = val
+                    elif type2 == 3:
+                        molecule.get_atom(pos).isotope = val
+                    elif type2 == 4:
+                        molecule.get_atom(pos).element = f"R{val}"
+                    elif type2 == 5:
+                        molecule.get_atom(pos).show_flag = Molecule.SHOW_FLAG_EXPLICIT
+                    elif type2 == 6:
+                        molecule.get_atom(pos).charge = val
+                    elif type2 == 7:
+                        molecule.get_bond(pos).stereo_direction = val
+            except (IndexError, ValueError):
+                raise BadMolFormatException("Invalid MDL MOL: M-block")
+
+        if init:
+            molecule.init_once()
+        return molecule
@@ -0,0 +1,292 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from multiprocessing import Pool
+from typing import Dict, List, Optional
+
+import config
+from entity import Atom, Bond, Molecule
+from util import logger
+from util.mdl_mol_parser import MdlMolParser
+
+"""
+预解析分子库
+将 resource/mol 下的分子解析并初始化后打包为一个二进制文件，程序通过 mmap 按序号或文件名直接取出分子，
+无需读取、解析文本:
+
+python -m util.mol_pack --output resource/mol.pack
+
+元数据中保存分子库目录的指纹（目录的修改时间与条目数），增删、重命名文件后 open_pack 不再使用过期的预解析文件；
+指纹不逐个检查文件，原地修改 .mol 文件内容时需手动重新生成
+
+文件格式（本机字节序）:
+    MAGIC | 版本 u32 | 分子数 u32 | 元数据长度 u32 | 元数据 JSON | 偏移表 u64 * (分子数 + 1) | 分子记录 ...
+分子记录:
+    cid i64 | 原子数 u32 | 化学键数 u32 | 平均键长 f64 | 源文本长度 u32 |
+    原子数组（按 ATOM_FIELDS 依次存放） | 化学键数组（按 BOND_FIELDS 依次存放） | 源文本
+"""
+
+MAGIC = b"CGPK"
+PACK_VERSION = 1
+
+_HEADER = struct.Struct("=4sIII")
+_RECORD = struct.Struct("=qIIdI")
+
+# (属性, array 类型码)，元素符号以元素表中的序号保存
+ATOM_FIELDS = (("x", "d"), ("y", "d"), ("z", "d"), ("element", "H"), ("charge", "h"), ("hydrogen_count", "h"),
+               ("isotope", "h"), ("mapnum", "h"), ("show_flag", "b"), ("spare_space", "b"), ("unpaired", "b"))
+BOND_FIELDS = (("from_atom", "i"), ("to", "i"), ("type", "b"), ("stereo_direction", "b"))
+
+logger = logger.Logger(config.log_level, "ChiralGrid-log.txt")
+
+
+def directory_fingerprint(directory: str) -> dict:
+    """
+    计算分子库目录的指纹，只读取目录本身，不逐个 stat 文件，启动时的开销与文件数基本无关
+
+    :return: {"count": 目录条目数, "mtime_ns": 目录的修改时间}，增删、重命名文件后都会变化
+    """
+
+    return {"count": len(os.listdir(directory)), "mtime_ns": os.stat(directory).st_mtime_ns}
+
+
+def pack_molecule(molecule: Molecule, elements: Dict[str, int]) -> bytes:
+    """
+    将已初始化的分子编码为一条分子记录
+
+    :param elements: 元素符号 -> 元素表序号，遇到新元素时追加
+    """
+
+    atoms, bonds = molecule.atoms, molecule.bonds
+    text = molecule.mdl_mol_str.encode("utf-8")
+    parts = [_RECORD.pack(molecule.cid, len(atoms), len(bonds), molecule.get_average_bond_length(), len(text))]
+    for name, code in ATOM_FIELDS:
+        if name == "element":
+            values = (elements.setdefault(a.element, len(elements)) for a in atoms)
+        else:
+            values = (getattr(a, name) for a in atoms)
+        parts.append(array(code, values).tobytes())
+    for name, code in BOND_FIELDS:
+        parts.append(array(code, (getattr(b, name) for b in bonds)).tobytes())
+    parts.append(text)
+    return b"".join(parts)
+
+
+def _pack_file(path: str):
+    """
+    解析并编码单个分子文件，在工作进程中执行；元素符号先以临时元素表编码，由主进程重新映射
+
+    :return: (文件名, 记录, 临时元素表)，失败时返回 None
+    """
+
+    try:
+        elements = {}
+        record = pack_molecule(MdlMolParser.parse_file(path), elements)
+        return os.path.basename(path), record, list(elements)
+    except Exception as e:
+        logger.error(f"Failed to pack {path}: {e}")
+        return None
+
+
+def _remap_elements(record: bytes, local: List[str], elements: Dict[str, int]) -> bytes:
+    """
+    将记录中的元素序号从临时元素表映射到全局元素表
+    """
+
+    n_atoms = _RECORD.unpack_from(record)[1]
+    pos = _RECORD.size
+    for name, code in ATOM_FIELDS:
+        size = array(code).itemsize * n_atoms
+        if name == "element":
+            ids = array(code)
+            ids.frombytes(record[pos:pos + size])
+            mapping = [elements.setdefault(e, len(elements)) for e in local]
+            ids = array(code, (mapping[i] for i in ids))
+            return record[:pos] + ids.tobytes() + record[pos + size:]
+        pos += size
+    return record
+
+
+def build_pack(directory: str, pack_path: str, processes: Optional[int] = None, chunksize: int = 32) -> int:
+    """
+    使用进程池解析分子库并写入预解析文件
+
+    :return: 打包的分子数
+    """
+
+    # 在解析之前计算指纹，打包期间目录发生变化时预解析文件会被视为过期
+    fingerprint = directory_fingerprint(directory)
+    files = sorted(f for f in os.listdir(directory) if f.endswith(".mol"))
+    paths = [os.path.join(directory, f) for f in files]
+    logger.info(f"Packing {len(paths)} molecules from {directory}...")
+
+    start = time.time()
+    names, records = [], []
+    elements: Dict[str, int] = {}
+    with Pool(processes) as pool:
+        for result in pool.imap(_pack_file, paths, chunksize):
+            if result is None:
+                continue
+            name, record, local = result
+            names.append(name)
+            records.append(_remap_elements(record, local, elements))
+
+    meta = json.dumps({
+        "byteorder": sys.byteorder,
+        "elements": list(elements),
+        "files": names,
+        "fingerprint": fingerprint,
+    }, ensure_ascii=False).encode("utf-8")
+    header = _HEADER.pack(MAGIC, PACK_VERSION, len(records), len(meta)) + meta
+    offsets = array("Q")
+    pos = len(header) + array("Q").itemsize * (len(records) + 1)
+    for record in records:
+        offsets.append(pos)
+        pos += len(record)
+    offsets.append(pos)
+
+    tmp_path = pack_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(offsets.tobytes())
+        for record in records:
+            f.write(record)
+    os.replace(tmp_path, pack_path)
+
+    logger.info(f"Packed {len(records)}/{len(paths)} molecules in {time.time() - start:.2f}s -> {pack_path}")
+    return len(records)
+
+
+class MolPack:
+    """
+    通过 mmap 读取预解析文件，按序号或文件名在 O(1) 时间内取出分子
+
+    with MolPack("resource/mol.pack") as pack:
+        molecule = pack.load_file("1.mol")
+    """
+
+    def __init__(self, pack_path: str):
+        self.pack_path = pack_path
+        with open(pack_path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, count, meta_len = _HEADER.unpack_from(self.mm)
+            if magic != MAGIC:
+                raise ValueError(f"Not a molecule pack: {pack_path}")
+            if version != PACK_VERSION:
+                raise ValueError(f"Unsupported pack version: {version}")
+            meta = json.loads(self.mm[_HEADER.size:_HEADER.size + meta_len].decode("utf-8"))
+            if meta["byteorder"] != sys.byteorder:
+                raise ValueError(f"Pack was built on a {meta['byteorder']}-endian machine")
+        except Exception:
+            self.mm.close()
+            raise
+
+        self.elements: List[str] = meta["elements"]
+        self.files: List[str] = meta["files"]
+        self.fingerprint: Optional[dict] = meta.get("fingerprint")  # 旧版本的预解析文件中没有
+        self.file_ids = {name: i for i, name in enumerate(self.files)}
+        self.offsets = array("Q")
+        start = _HEADER.size + meta_len
+        self.offsets.frombytes(self.mm[start:start + self.offsets.itemsize * (count + 1)])
+
+    def __len__(self):
+        return len(self.files)
+
+    def __contains__(self, file_name: str):
+        return file_name in self.file_ids
+
+    def load(self, i: int) -> Molecule:
+        """
+        取出第 i 个分子，返回的分子已初始化，可以直接渲染
+        """
+
+        mm = self.mm
+        pos = self.offsets[i]
+        cid, n_atoms, n_bonds, avg_bond_length, text_len = _RECORD.unpack_from(mm, pos)
+        pos += _RECORD.size
+
+        columns = {}
+        for name, code, n in [(name, code, n_atoms) for name, code in ATOM_FIELDS] + \
+                             [(name, code, n_bonds) for name, code in BOND_FIELDS]:
+            values = array(code)
+            size = values.itemsize * n
+            values.frombytes(mm[pos:pos + size])
+            columns[name] = values
+            pos += size
+        text = mm[pos:pos + text_len].decode("utf-8")
+
+        elements = self.elements
+        atoms = [Atom(charge, elements[element], show_flag, hydrogen_count, spare_space, isotope, mapnum, unpaired)
+                 for element, charge, hydrogen_count, isotope, mapnum, show_flag, spare_space, unpaired
+                 in zip(columns["element"], columns["charge"], columns["hydrogen_count"], columns["isotope"],
+                        columns["mapnum"], columns["show_flag"], columns["spare_space"], columns["unpaired"])]
+        bonds = [Bond(from_atom, to, type_, stereo)
+                 for from_atom, to, type_, stereo
+                 in zip(columns["from_atom"], columns["to"], columns["type"], columns["stereo_direction"])]
+
+        molecule = Molecule(cid, atoms, bonds, text, (columns["x"], columns["y"], columns["z"]))
+        # 分子库中已保存几何属性，无需再次计算
+        molecule.avg_bond_length = avg_bond_length
+        molecule.inval_geometry = False
+        return molecule
+
+    def load_file(self, file_name: str) -> Molecule:
+        """
+        按文件名取出分子
+        """
+
+        return self.load(self.file_ids[file_name])
+
+    def close(self):
+        self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def open_pack(pack_path: str, mol_dir: Optional[str] = None) -> Optional[MolPack]:
+    """
+    打开预解析文件，文件不存在、格式不符或与分子库目录不一致时返回 None
+
+    :param mol_dir: 分子库目录，给出时检查预解析文件是否由该目录的当前内容生成
+    """
+
+    if not pack_path or not os.path.isfile(pack_path):
+        return None
+    try:
+        pack = MolPack(pack_path)
+    except (ValueError, KeyError, OSError, struct.error) as e:
+        logger.error(f"Ignoring molecule pack {pack_path}: {e}")
+        return None
+
+    if mol_dir is not None:
+        try:
+            fingerprint = directory_fingerprint(mol_dir)
+        except OSError as e:
+            fingerprint = None
+            logger.error(f"Failed to fingerprint {mol_dir}: {e}")
+        if fingerprint is None or pack.fingerprint != fingerprint:
+            logger.error(f"Ignoring stale molecule pack {pack_path}: {mol_dir} has changed since it was built, "
+                         f"run `python -m util.mol_pack` to rebuild it")
+            pack.close()
+            return None
+    return pack
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Pack parsed ChiralGrid molecules into one memory-mapped file")
+    parser.add_argument("--mol-dir", default="resource/mol", help="directory of .mol files")
+    parser.add_argument("--output", default=config.mol_pack_path, help="pack file path")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes (default: all CPUs)")
+    parser.add_argument("--chunksize", type=int, default=32, help="files per worker task")
+    args = parser.parse_args()
+    build_pack(args.mol_dir, args.output, args.processes, args.chunksize)
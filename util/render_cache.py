@@ -0,0 +1,303 @@
+import hashlib
+import io
+import json
+import multiprocessing.util
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows，不加进程间锁，并发淘汰时最多重复删除同一文件
+    fcntl = None
+
+from PIL import Image
+
+import config
+from entity import Molecule
+from util import logger
+
+"""
+渲染结果缓存
+分子内容与渲染参数相同时渲染结果也相同，以二者的哈希为键缓存渲染结果与网格数据、答案，
+磁盘与内存分别按字节预算做 LRU 淘汰，重复抽到的分子无需重新渲染:
+内存中保存解码后的图像，命中时直接返回；磁盘中保存编码后的 PNG，编码与写入在后台线程中完成，不占用渲染的调用方
+
+缓存文件 {directory}/{key[:2]}/{key}.bin: JSON 长度 u32 | JSON {"grid_data", "answer"} | PNG
+多个进程共用同一缓存目录时，磁盘预算对整个目录生效：各进程在最近一次统计结果上累加自己写入的字节数，
+超出预算或距上次统计超过 RESCAN_INTERVAL 秒时，才在锁文件 {directory}/.lock 的保护下重新统计目录中的所有缓存文件，
+按修改时间（即最近访问时间）淘汰至预算的 EVICT_TARGET 以下，留出余量避免每次写入都重新统计
+"""
+
+# 渲染结果格式变化时递增，使旧缓存失效
+CACHE_VERSION = 2
+
+_HEADER = struct.Struct("=I")
+
+# 重新统计缓存目录的最长间隔（秒），用于计入其他进程的写入
+RESCAN_INTERVAL = 60.0
+# 超出预算时淘汰至预算的该比例以下
+EVICT_TARGET = 0.9
+
+logger = logger.Logger(config.log_level, "ChiralGrid-log.txt")
+
+# (图像, PNG 字节串（尚未编码时为 None）, 网格数据, 答案)
+Entry = Tuple[Image.Image, Optional[bytes], dict, list]
+
+
+def cache_key(molecule: Molecule, params: dict) -> str:
+    """
+    由分子内容、渲染参数（含作弊模式）与手性碳检测引擎计算缓存键
+    """
+
+    h = hashlib.sha256()
+    h.update(json.dumps({"version": CACHE_VERSION, "chiral_mode": config.chiral_mode, "params": params},
+                        sort_keys=True, default=str).encode("utf-8"))
+    h.update(b"\0")
+    h.update(molecule.mdl_mol_str.encode("utf-8"))
+    return h.hexdigest()
+
+
+def encode_entry(png: bytes, grid_data: dict, answer: list) -> bytes:
+    meta = json.dumps({"grid_data": grid_data, "answer": answer}, ensure_ascii=False).encode("utf-8")
+    return _HEADER.pack(len(meta)) + meta + png
+
+
+def decode_entry(data: bytes) -> Entry:
+    meta_len, = _HEADER.unpack_from(data)
+    meta = json.loads(data[_HEADER.size:_HEADER.size + meta_len].decode("utf-8"))
+    # JSON 中的原子信息为列表，还原为渲染时的元组
+    grid_data = {k: [tuple(e) for e in v] if k.endswith(".elems") else v for k, v in meta["grid_data"].items()}
+    png = data[_HEADER.size + meta_len:]
+    image = Image.open(io.BytesIO(png))
+    image.load()
+    return image, png, grid_data, meta["answer"]
+
+
+def encode_png(image: Image.Image) -> bytes:
+    buf = io.BytesIO()
+    image.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def entry_size(entry: Entry) -> int:
+    """
+    缓存项在内存中占用的字节数，图像按像素数据计算
+    """
+
+    image, png = entry[0], entry[1]
+    return image.width * image.height * len(image.getbands()) + (len(png) if png is not None else 0)
+
+
+class RenderCache:
+    """
+    渲染结果缓存，线程安全；多个进程可以共用同一个缓存目录，磁盘预算由所有进程共同遵守
+    返回的图像由缓存与所有命中的调用方共享，不能修改
+    """
+
+    def __init__(self, directory: str, max_bytes: int, memory_bytes: int = 0):
+        """
+        :param directory: 缓存目录
+        :param max_bytes: 磁盘缓存的字节预算，0 表示不使用磁盘缓存
+        :param memory_bytes: 内存缓存的字节预算，0 表示不使用内存缓存
+        """
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self.lock = threading.Lock()
+        self.writer = None  # 写磁盘缓存的后台线程，首次写入时创建
+        self.evict_lock = threading.Lock()  # 统计目录耗时较长，不占用 lock，避免阻塞内存缓存的读取
+
+        self.memory: OrderedDict[str, Tuple[int, Entry]] = OrderedDict()  # 键 -> (字节数, 缓存项)
+        self.memory_size = 0
+        self.disk_size = 0  # 最近一次统计时整个缓存目录的字节数，加上此后本进程写入的字节数
+        self.scanned_at = 0.0  # 最近一次统计的时间（time.monotonic）
+        self.hits = self.misses = 0
+        if self.max_bytes > 0:
+            self.evict_disk()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.bin")
+
+    def scan(self):
+        """
+        统计缓存目录中的所有缓存文件（包括其他进程写入的）
+
+        :return: [(修改时间, 键, 字节数)]，按修改时间从旧到新排序
+        """
+
+        files = []
+        if os.path.isdir(self.directory):
+            for root, _, names in os.walk(self.directory):
+                for name in names:
+                    if name.endswith(".bin"):
+                        try:
+                            st = os.stat(os.path.join(root, name))
+                        except FileNotFoundError:  # 刚被其他进程淘汰
+                            continue
+                        files.append((st.st_mtime, name[:-4], st.st_size))
+        files.sort()
+        return files
+
+    def get(self, key: str) -> Optional[Entry]:
+        """
+        :return: (图像, PNG 字节串, 网格数据, 答案)，未命中时返回 None；内存中的缓存项尚未编码时 PNG 为 None
+        """
+
+        with self.lock:
+            item = self.memory.get(key)
+            if item is not None:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return item[1]
+
+        if self.max_bytes > 0:
+            # 直接读取文件，其他进程写入的缓存也能命中
+            path = self.path(key)
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+                os.utime(path)  # 修改时间作为访问时间，淘汰时按此排序
+                entry = decode_entry(data)
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError, KeyError, struct.error) as e:
+                # 可能正被其他进程淘汰或文件损坏
+                logger.debug("Render cache miss on %s: %s", path, e)
+            else:
+                with self.lock:
+                    self.hits += 1
+                self.put_memory(key, entry)
+                return entry
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, image: Image.Image, grid_data: dict, answer: list, png: Optional[bytes] = None):
+        """
+        立即放入内存缓存，磁盘缓存在后台线程中编码并写入
+
+        :param png: 调用方已编码的图像，给定时不再重复编码
+        """
+
+        self.put_memory(key, (image, png, grid_data, answer))
+        if self.max_bytes <= 0:
+            return
+        with self.lock:
+            if self.writer is None:
+                self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="RenderCacheWriter")
+            writer = self.writer
+        writer.submit(self.write_disk, key, image, grid_data, answer, png)
+
+    def flush(self):
+        """
+        等待已提交的磁盘写入完成
+        """
+
+        with self.lock:
+            writer, self.writer = self.writer, None
+        if writer is not None:
+            writer.shutdown(wait=True)
+
+    def write_disk(self, key: str, image: Image.Image, grid_data: dict, answer: list, png: Optional[bytes]):
+        try:
+            data = encode_entry(png if png is not None else encode_png(image), grid_data, answer)
+        except Exception as e:
+            logger.error(f"Failed to encode render cache {key}: {e}")
+            return
+        if len(data) > self.max_bytes:
+            return
+
+        path = self.path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"Failed to write render cache {path}: {e}")
+            return
+
+        with self.lock:
+            self.disk_size += len(data)  # 覆盖已有文件时偏大，只会使统计提前
+            rescan = self.disk_size > self.max_bytes or time.monotonic() - self.scanned_at > RESCAN_INTERVAL
+        if rescan:
+            self.evict_disk()
+
+    def put_memory(self, key: str, entry: Entry):
+        size = entry_size(entry)
+        if self.memory_bytes <= 0 or size > self.memory_bytes:
+            return
+        with self.lock:
+            old = self.memory.pop(key, None)
+            if old is not None:
+                self.memory_size -= old[0]
+            self.memory[key] = (size, entry)
+            self.memory_size += size
+            while self.memory_size > self.memory_bytes:
+                _, (old_size, _) = self.memory.popitem(last=False)
+                self.memory_size -= old_size
+
+    def evict_disk(self):
+        """
+        重新统计整个缓存目录，超出预算时删除最久未访问的缓存文件，直到磁盘占用不超过预算的 EVICT_TARGET
+        统计与删除在锁文件的保护下进行，多个进程同时写入时不会重复删除
+        """
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            lock_file = open(os.path.join(self.directory, ".lock"), "a")
+        except OSError as e:
+            logger.error(f"Failed to lock render cache {self.directory}: {e}")
+            return
+
+        with lock_file, self.evict_lock:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)  # 关闭文件时释放
+            files = self.scan()
+            size = sum(f[2] for f in files)
+            target = self.max_bytes * EVICT_TARGET if size > self.max_bytes else size
+            for _, key, file_size in files:
+                if size <= target:
+                    break
+                try:
+                    os.remove(self.path(key))
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.error(f"Failed to evict render cache {key}: {e}")
+                    continue
+                size -= file_size
+            with self.lock:
+                self.disk_size = size
+                self.scanned_at = time.monotonic()
+
+
+_cache = None
+_cache_pid = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Optional[RenderCache]:
+    """
+    获取按 config 配置的渲染缓存，磁盘与内存预算都为 0 时返回 None
+    fork 出的子进程中会重新创建；进程正常退出时（包括进程池的工作进程）等待尚未完成的磁盘写入
+    """
+
+    global _cache, _cache_pid
+    if config.render_cache_max_bytes <= 0 and config.render_cache_memory_bytes <= 0:
+        return None
+    with _cache_lock:
+        if _cache is None or _cache_pid != os.getpid():
+            _cache = RenderCache(config.render_cache_dir, config.render_cache_max_bytes,
+                                 config.render_cache_memory_bytes)
+            _cache_pid = os.getpid()
+            multiprocessing.util.Finalize(_cache, _cache.flush, exitpriority=10)
+        return _cache
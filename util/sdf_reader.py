@@ -0,0 +1,154 @@
+import argparse
+import re
+import sys
+import time
+from collections import deque
+from multiprocessing import Pool
+from typing import BinaryIO, Callable, Iterator, List, Optional, Tuple
+
+import config
+from entity import Molecule
+from util import logger
+from util.mdl_mol_parser import MdlMolParser
+
+"""
+流式读取 SDF 文件
+SDF 文件由若干以 "$$$$" 行分隔的 MOL 记录组成，按块读取并逐条解析，内存占用与文件大小无关；
+解析失败的记录会被报告并跳过，不会中断读取:
+
+python -m util.sdf_reader compounds.sdf --workers 8
+"""
+
+logger = logger.Logger(config.log_level, "ChiralGrid-log.txt")
+
+# 记录分隔行
+_DELIMITER = re.compile(rb"^\$\$\$\$[^\r\n]*\r?\n", re.MULTILINE)
+
+CHUNK_SIZE = 1 << 20
+
+# 出错回调: (记录序号, 记录在文件中的字节偏移, 错误信息)
+ErrorHandler = Callable[[int, int, str], None]
+
+
+def iter_records(f: BinaryIO, chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[int, int, bytes]]:
+    """
+    从二进制文件中逐条读取 SDF 记录
+
+    :return: (记录序号, 字节偏移, 记录内容) 的迭代器，序号从 1 开始
+    """
+
+    buf = b""
+    offset = 0
+    index = 0
+    while True:
+        chunk = f.read(chunk_size)
+        buf += chunk
+        if not chunk and buf and not buf.endswith(b"\n"):
+            buf += b"\n"  # 最后一个分隔行可能没有换行符
+
+        pos = 0
+        for m in _DELIMITER.finditer(buf):
+            index += 1
+            yield index, offset + pos, buf[pos:m.start()]
+            pos = m.end()
+        buf = buf[pos:]
+        offset += pos
+        if not chunk:
+            break
+
+    if buf.strip():  # 没有以分隔行结尾的最后一条记录
+        yield index + 1, offset, buf
+
+
+def parse_record(record: Tuple[int, int, bytes]) -> Tuple[int, int, Optional[Molecule], Optional[str]]:
+    """
+    解析单条记录
+
+    :return: (记录序号, 字节偏移, 分子, 错误信息)，解析失败时分子为 None
+    """
+
+    index, offset, data = record
+    try:
+        return index, offset, MdlMolParser.parse_bytes(data), None
+    except Exception as e:
+        return index, offset, None, f"{type(e).__name__}: {e}"
+
+
+def parse_records(records: List[Tuple[int, int, bytes]]):
+    """
+    解析一批记录，在工作进程中执行
+    """
+
+    return [parse_record(r) for r in records]
+
+
+def _batches(records, batch_size: int):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _parse_parallel(records, workers: int, batch_size: int):
+    """
+    使用进程池按顺序解析记录，同时在处理的批次不超过 2 * workers，保证内存有界
+    """
+
+    with Pool(workers) as pool:
+        pending = deque()
+        for batch in _batches(records, batch_size):
+            pending.append(pool.apply_async(parse_records, (batch,)))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+
+
+def read_sdf(path: str, workers: int = 1, batch_size: int = 64,
+             on_error: Optional[ErrorHandler] = None) -> Iterator[Molecule]:
+    """
+    流式读取 SDF 文件中的分子，按记录在文件中的顺序返回
+
+    :param workers: 解析进程数，大于 1 时使用进程池并行解析
+    :param batch_size: 并行解析时每个任务包含的记录数
+    :param on_error: 记录解析失败时的回调，默认写入错误日志；失败的记录会被跳过
+    """
+
+    with open(path, "rb") as f:
+        records = iter_records(f)
+        results = _parse_parallel(records, workers, batch_size) if workers > 1 else map(parse_record, records)
+        for index, offset, molecule, error in results:
+            if molecule is not None:
+                yield molecule
+            elif on_error is not None:
+                on_error(index, offset, error)
+            else:
+                logger.error("Bad SDF record #%s at byte %s in %s: %s", index, offset, path, error)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Read molecules from an SDF file and report bad records")
+    parser.add_argument("path", help="SDF file")
+    parser.add_argument("--workers", type=int, default=1, help="parser processes")
+    parser.add_argument("--batch-size", type=int, default=64, help="records per worker task")
+    parser.add_argument("--progress-every", type=int, default=10000, help="report progress every N molecules")
+    args = parser.parse_args()
+
+    errors = []
+
+    def report_error(index, offset, error):
+        errors.append(index)
+        print(f"record #{index} (byte {offset}): {error}", file=sys.stderr)
+
+    count = 0
+    start = time.time()
+    for count, _ in enumerate(read_sdf(args.path, args.workers, args.batch_size, report_error), start=1):
+        if count % args.progress_every == 0:
+            print(f"[{count}] {count / (time.time() - start):.1f} molecules/sec", file=sys.stderr, flush=True)
+    elapsed = time.time() - start
+    print(f"Read {count} molecules ({len(errors)} bad records) in {elapsed:.2f}s, "
+          f"{count / elapsed if elapsed > 0 else 0.0:.1f} molecules/sec")